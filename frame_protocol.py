@@ -0,0 +1,64 @@
+"""
+Formato binário das respostas em lote de /process_video_frames_bytes
+Compartilhado entre o serviço BentoML (que monta a resposta) e o servidor WebSocket (que a lê)
+
+Formato: uint32 big-endian com o tamanho do cabeçalho JSON, o cabeçalho
+{"results": [...]} e, em seguida, os JPEGs anotados concatenados na ordem dos
+resultados; cada resultado com frame anotado traz o seu tamanho em "annotated_frame_size".
+"""
+
+import json
+import struct
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+_HEADER_SIZE = struct.Struct(">I")
+
+
+def pack_frames_response(header: Dict[str, Any], frames: List[bytes]) -> bytes:
+    """
+    Monta a resposta binária a partir do cabeçalho e dos JPEGs anotados
+    
+    Args:
+        header: Cabeçalho JSON ({"results": [...]}, com "annotated_frame_size" nos resultados)
+        frames: JPEGs anotados, na ordem dos resultados que os referenciam
+    
+    Returns:
+        bytes: Corpo da resposta
+    """
+    header_bytes = json.dumps(header).encode("utf-8")
+    return b"".join([_HEADER_SIZE.pack(len(header_bytes)), header_bytes, *frames])
+
+
+def unpack_frames_response(
+    body: bytes,
+    loads: Callable[[bytes], Any] = json.loads
+) -> Tuple[Dict[str, Any], Iterator[bytes]]:
+    """
+    Separa uma resposta montada por pack_frames_response
+    
+    Args:
+        body: Corpo da resposta
+        loads: Desserializador do cabeçalho JSON
+    
+    Returns:
+        Tuple: (cabeçalho JSON, iterador com os JPEGs anotados na ordem dos resultados)
+    
+    Raises:
+        struct.error: Corpo menor que o prefixo de tamanho
+        ValueError: Cabeçalho truncado ou JSON inválido
+    """
+    (header_size,) = _HEADER_SIZE.unpack_from(body)
+    start = _HEADER_SIZE.size
+    if len(body) < start + header_size:
+        raise ValueError(f"Cabeçalho truncado: {len(body) - start} de {header_size} bytes")
+    header = loads(body[start:start + header_size])
+    
+    def frames() -> Iterator[bytes]:
+        offset = start + header_size
+        for result in header.get("results", []):
+            size = result.get("annotated_frame_size")
+            if size is not None:
+                yield body[offset:offset + size]
+                offset += size
+    
+    return header, frames()
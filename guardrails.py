@@ -8,17 +8,35 @@ Este módulo implementa guardrails de segurança baseados nos padrões de design
 - Rate Limiting: Controle de taxa de requisições por sessão
 """
 
-import base64
+import os
+import re
+import pybase64
 import time
 import logging
+import threading
 import numpy as np
 import cv2
-from typing import Tuple, List, Dict, Any
-from collections import defaultdict
+import xxhash
+from typing import Tuple, List, Dict, Any, Optional, Callable
+from collections import defaultdict, deque, OrderedDict
 
 # Configurar logging
 logger = logging.getLogger(__name__)
 
+# Session IDs válidos: 1-256 caracteres alfanuméricos ASCII, _ ou -
+_SESSION_ID_RE = re.compile(r"\A[A-Za-z0-9_\-]{1,256}\Z")
+
+# Flags de decodificação reduzida do libjpeg (IDCT em 1/2, 1/4 ou 1/8 da resolução),
+# da maior redução para a menor
+_REDUCED_DECODE_FLAGS = {
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+}
+
+# Marcadores SOF (Start Of Frame) do JPEG; C4, C8 e CC têm outro significado
+_JPEG_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
 # =============================================================================
 # INPUT VALIDATION GUARDRAILS
 # =============================================================================
@@ -26,7 +44,12 @@ logger = logging.getLogger(__name__)
 class RateLimiter:
     """Rate Limiter para controle de taxa de requisições por sessão"""
     
-    _requests = defaultdict(list)
+    GC_INTERVAL = 30.0  # Segundos entre varreduras de sessões inativas
+    SESSION_STALE_SECS = 60.0  # Sessão sem requisições há mais tempo que isso é descartada
+    
+    _requests = defaultdict(deque)
+    _lock = threading.Lock()
+    _last_gc = time.time()
     
     @staticmethod
     def check(session_id: str, max_per_second: int = 30) -> Tuple[bool, str]:
@@ -41,24 +64,59 @@ class RateLimiter:
             Tuple[bool, str]: (is_allowed, error_message)
         """
         now = time.time()
-        requests = RateLimiter._requests[session_id]
-        
-        # Remover requisições antigas (> 1 segundo)
-        requests[:] = [req_time for req_time in requests if now - req_time < 1.0]
         
-        # Verificar limite
-        if len(requests) >= max_per_second:
-            return False, f"Rate limit exceeded: max {max_per_second} requests/second"
+        # Sessões que caíram sem reset_session ficariam no dict para sempre;
+        # a varredura é amortizada entre as chamadas, a cada GC_INTERVAL segundos
+        if now - RateLimiter._last_gc >= RateLimiter.GC_INTERVAL:
+            RateLimiter.gc(RateLimiter.SESSION_STALE_SECS)
         
-        # Registrar nova requisição
-        requests.append(now)
+        with RateLimiter._lock:
+            requests = RateLimiter._requests[session_id]
+            
+            # Remover requisições antigas (> 1 segundo) pela esquerda da janela
+            while requests and now - requests[0] >= 1.0:
+                requests.popleft()
+            
+            # Verificar limite
+            if len(requests) >= max_per_second:
+                return False, f"Rate limit exceeded: max {max_per_second} requests/second"
+            
+            # Registrar nova requisição
+            requests.append(now)
         return True, "OK"
     
+    @staticmethod
+    def gc(stale_secs: float = 60.0) -> int:
+        """
+        Remove sessões sem requisições nos últimos stale_secs segundos
+        
+        Args:
+            stale_secs: Tempo sem requisições para considerar a sessão inativa
+            
+        Returns:
+            int: Número de sessões removidas
+        """
+        now = time.time()
+        
+        with RateLimiter._lock:
+            RateLimiter._last_gc = now
+            stale = [
+                session_id for session_id, requests in RateLimiter._requests.items()
+                if not requests or now - requests[-1] > stale_secs
+            ]
+            for session_id in stale:
+                del RateLimiter._requests[session_id]
+        
+        if stale:
+            logger.debug("Rate limiter: %d sessões inativas removidas", len(stale))
+        return len(stale)
+    
     @staticmethod
     def reset_session(session_id: str):
         """Reseta contador de rate limiting para uma sessão"""
-        if session_id in RateLimiter._requests:
-            del RateLimiter._requests[session_id]
+        with RateLimiter._lock:
+            if session_id in RateLimiter._requests:
+                del RateLimiter._requests[session_id]
 
 
 class FrameValidator:
@@ -73,20 +131,56 @@ class FrameValidator:
     MAX_FRAME_DIMENSION = 4096  # Pixels
     MAX_FPS_PER_SESSION = 30  # Frames por segundo por sessão
     MIN_BASE64_LENGTH = 100  # Tamanho mínimo esperado para base64
+    # Frames decodificados mantidos em cache (0 = desativado). Opt-in pela variável de ambiente
+    # MOT_CEL_DECODE_CACHE_SIZE: numa câmera ao vivo frames idênticos byte a byte são raros
+    DECODE_CACHE_SIZE = int(os.environ.get("MOT_CEL_DECODE_CACHE_SIZE", "0"))
+    DECODE_CACHE_MAX_BYTES = 64 * 1024 * 1024  # Memória máxima do cache (frames maiores não entram)
+    TARGET_MIN_DIM = None  # Menor dimensão necessária após decodificar (None = resolução original)
+    
+    _decode_cache = OrderedDict()
+    _decode_cache_bytes = 0
+    _decode_cache_lock = threading.Lock()
     
     @staticmethod
-    def validate_frame_data(frame_data: str, session_id: str) -> Tuple[bool, str, np.ndarray]:
+    def validate_frame_data(frame_data: str, session_id: str,
+                            target_min_dim: Optional[int] = None,
+                            decoder: Optional[Callable[[bytes], Any]] = None,
+                            *, for_drawing: bool = False) -> Tuple[bool, str, np.ndarray]:
         """
         Valida dados do frame antes de processar
         
         Args:
             frame_data: String base64 do frame
             session_id: ID da sessão para rate limiting
+            target_min_dim: Menor dimensão necessária no frame decodificado; JPEGs com
+                folga de 2x, 4x ou 8x são decodificados já reduzidos (padrão: TARGET_MIN_DIM)
+            decoder: Decodificador alternativo (ver validate_frame_bytes)
+            for_drawing: O chamador vai desenhar no frame (ver validate_frame_bytes)
             
         Returns:
             Tuple[bool, str, np.ndarray]: (is_valid, error_message, decoded_frame)
             Se is_valid=False, decoded_frame será None
         """
+        is_valid, error_msg, frame_bytes = FrameValidator.decode_frame_data(frame_data)
+        if not is_valid:
+            return False, error_msg, None
+        
+        return FrameValidator.validate_frame_bytes(
+            frame_bytes, session_id, target_min_dim, decoder, for_drawing=for_drawing
+        )
+    
+    @staticmethod
+    def decode_frame_data(frame_data: str) -> Tuple[bool, str, bytes]:
+        """
+        Valida a string base64 do frame e a decodifica para os bytes da imagem
+        
+        Args:
+            frame_data: String base64 do frame (com ou sem prefixo data URL)
+            
+        Returns:
+            Tuple[bool, str, bytes]: (is_valid, error_message, frame_bytes)
+            Se is_valid=False, frame_bytes será None
+        """
         # 1. Verificar se frame_data não está vazio
         if not frame_data or not isinstance(frame_data, str):
             return False, "Frame data está vazio ou não é string", None
@@ -100,29 +194,70 @@ class FrameValidator:
         
         # 3. Extrair base64 (remover prefixo data URL se presente)
         try:
-            if "," in frame_data:
-                # Formato: "data:image/jpeg;base64,<base64_data>"
-                base64_part = frame_data.split(",")[-1]
-            else:
-                base64_part = frame_data
+            # Formato: "data:image/jpeg;base64,<base64_data>"
+            # rpartition não monta lista nem copia o prefixo (sem vírgula devolve a própria string)
+            base64_part = frame_data.rpartition(",")[2]
             
             # 4. Decodificar base64 para bytes
             try:
-                frame_bytes = base64.b64decode(base64_part, validate=True)
+                frame_bytes = pybase64.b64decode(base64_part, validate=True)
             except Exception as e:
                 return False, f"Formato base64 inválido: {str(e)}", None
+        
+        except Exception as e:
+            logger.error(f"Erro inesperado na validação do frame: {type(e).__name__} - {e}")
+            return False, f"Erro na validação: {str(e)}", None
+        
+        return True, "OK", frame_bytes
+    
+    @staticmethod
+    def validate_frame_bytes(frame_bytes: bytes, session_id: str,
+                             target_min_dim: Optional[int] = None,
+                             decoder: Optional[Callable[[bytes], Any]] = None,
+                             *, for_drawing: bool = False) -> Tuple[bool, str, np.ndarray]:
+        """
+        Valida um frame já em bytes (JPEG/PNG recebido em binário, sem base64)
+        
+        Args:
+            frame_bytes: Bytes da imagem codificada
+            session_id: ID da sessão para rate limiting
+            target_min_dim: Menor dimensão necessária no frame decodificado (padrão: TARGET_MIN_DIM)
+            decoder: Decodificador alternativo ao cv2.imdecode (ex.: nvJPEG na GPU); deve devolver
+                um array-like (H, W, 3) ou None. Frames decodificados assim não passam pelo cache
+                nem pela decodificação reduzida
+            for_drawing: O chamador vai desenhar direto no frame; frames decodificados não
+                entram no cache de decodificação (ver _decode_image)
             
+        Returns:
+            Tuple[bool, str, np.ndarray]: (is_valid, error_message, decoded_frame)
+            Se is_valid=False, decoded_frame será None
+        """
+        if target_min_dim is None:
+            target_min_dim = FrameValidator.TARGET_MIN_DIM
+        
+        try:
             # 5. Verificar tamanho dos bytes decodificados
-            if len(frame_bytes) == 0:
+            if not frame_bytes:
                 return False, "Frame decodificado está vazio", None
             
             if len(frame_bytes) > FrameValidator.MAX_FRAME_SIZE:
                 return False, f"Frame decodificado muito grande: {len(frame_bytes)} bytes", None
             
             # 6. Converter bytes para numpy array e decodificar imagem
+            #    (JPEGs muito maiores que o necessário são decodificados já reduzidos)
+            source_size = None
+            decode_flags = cv2.IMREAD_COLOR
+            if target_min_dim and decoder is None:
+                source_size = FrameValidator.jpeg_dimensions(frame_bytes)
+                if source_size is not None:
+                    factor = FrameValidator.reduction_factor(*source_size, target_min_dim)
+                    decode_flags = _REDUCED_DECODE_FLAGS.get(factor, cv2.IMREAD_COLOR)
+            
             try:
-                nparr = np.frombuffer(frame_bytes, np.uint8)
-                frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+                if decoder is not None:
+                    frame = decoder(frame_bytes)
+                else:
+                    frame = FrameValidator._decode_image(frame_bytes, decode_flags, for_drawing)
             except Exception as e:
                 return False, f"Erro ao decodificar imagem: {str(e)}", None
             
@@ -130,8 +265,10 @@ class FrameValidator:
             if frame is None:
                 return False, "Não foi possível decodificar a imagem do frame", None
             
-            # 8. Verificar dimensões do frame
+            # 8. Verificar dimensões do frame (as da imagem original, se decodificada reduzida)
             h, w = frame.shape[:2]
+            if decode_flags != cv2.IMREAD_COLOR:
+                w, h = source_size
             
             if h < FrameValidator.MIN_FRAME_DIMENSION or w < FrameValidator.MIN_FRAME_DIMENSION:
                 return False, f"Frame muito pequeno: {w}x{h} pixels (min: {FrameValidator.MIN_FRAME_DIMENSION}x{FrameValidator.MIN_FRAME_DIMENSION})", None
@@ -153,13 +290,136 @@ class FrameValidator:
                 return False, rate_error, None
             
             # Frame válido!
-            logger.debug(f"Frame válido para sessão {session_id}: {w}x{h}, {len(frame_bytes)} bytes")
+            logger.debug(
+                "Frame válido para sessão %s: %dx%d, %d bytes", session_id, w, h, len(frame_bytes)
+            )
             return True, "OK", frame
         
         except Exception as e:
             logger.error(f"Erro inesperado na validação do frame: {type(e).__name__} - {e}")
             return False, f"Erro na validação: {str(e)}", None
     
+    @staticmethod
+    def jpeg_dimensions(frame_bytes: bytes) -> Optional[Tuple[int, int]]:
+        """
+        Lê as dimensões de um JPEG no marcador SOF, sem decodificar a imagem
+        
+        Args:
+            frame_bytes: Bytes da imagem codificada
+            
+        Returns:
+            Optional[Tuple[int, int]]: (largura, altura), ou None se não for JPEG
+            ou se o marcador SOF não for encontrado
+        """
+        size = len(frame_bytes)
+        if size < 4 or frame_bytes[0] != 0xFF or frame_bytes[1] != 0xD8:
+            return None
+        
+        pos = 2
+        while pos + 8 < size:
+            if frame_bytes[pos] != 0xFF:
+                return None
+            marker = frame_bytes[pos + 1]
+            
+            # Bytes de preenchimento e marcadores sem segmento
+            if marker == 0xFF:
+                pos += 1
+                continue
+            if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+                pos += 2
+                continue
+            
+            if marker in _JPEG_SOF_MARKERS:
+                height = (frame_bytes[pos + 5] << 8) | frame_bytes[pos + 6]
+                width = (frame_bytes[pos + 7] << 8) | frame_bytes[pos + 8]
+                return width, height
+            
+            # Início dos dados comprimidos (SOS) ou fim da imagem antes do SOF
+            if marker in (0xD9, 0xDA):
+                return None
+            
+            pos += 2 + ((frame_bytes[pos + 2] << 8) | frame_bytes[pos + 3])
+        
+        return None
+    
+    @staticmethod
+    def reduction_factor(width: int, height: int, target_min_dim: Optional[int]) -> int:
+        """
+        Escolhe a maior redução de decodificação que mantém a menor dimensão >= target_min_dim
+        
+        É o fator que validate_frame_bytes usa para um JPEG com essas dimensões no SOF
+        
+        Returns:
+            int: 8, 4 ou 2 (decodificação reduzida) ou 1 (resolução original)
+        """
+        if not target_min_dim:
+            return 1
+        min_dim = min(width, height)
+        for factor in _REDUCED_DECODE_FLAGS:
+            if min_dim >= factor * target_min_dim:
+                return factor
+        return 1
+    
+    @staticmethod
+    def _decode_image(frame_bytes: bytes, flags: int = cv2.IMREAD_COLOR,
+                      for_drawing: bool = False) -> np.ndarray:
+        """
+        Decodifica a imagem reaproveitando frames idênticos recentes
+        
+        Frames repetidos byte a byte (câmera pausada, cliente reenviando o mesmo JPEG) são
+        servidos de um cache LRU indexado pelo hash xxh3 do conteúdo, evitando um novo
+        cv2.imdecode. O cache vem desativado (DECODE_CACHE_SIZE = 0): frames apenas parecidos
+        já pulam a inferência pela comparação de miniaturas do serviço (FRAME_DIFF_THRESHOLD),
+        e só um cliente que repete JPEGs idênticos ganha algo com ele.
+        Frames em cache são compartilhados e por isso marcados como somente leitura. Numa
+        falta de cache, um frame em que o chamador vai desenhar (for_drawing) volta gravável
+        e não entra no cache, já que guardá-lo exigiria copiar o frame inteiro.
+        O cache é limitado em entradas (DECODE_CACHE_SIZE) e em bytes (DECODE_CACHE_MAX_BYTES).
+        
+        Args:
+            frame_bytes: Bytes da imagem codificada (JPEG/PNG)
+            flags: Flag de decodificação do cv2.imdecode
+            for_drawing: O chamador vai desenhar direto no frame
+            
+        Returns:
+            np.ndarray: Frame BGR decodificado, ou None se a decodificação falhar
+        """
+        cache_size = FrameValidator.DECODE_CACHE_SIZE
+        if cache_size <= 0:
+            return cv2.imdecode(np.frombuffer(frame_bytes, np.uint8), flags)
+        
+        # O tamanho entra na chave para descartar colisões entre frames de tamanhos diferentes;
+        # a flag separa decodificações do mesmo frame em resoluções diferentes
+        key = (len(frame_bytes), xxhash.xxh3_64_intdigest(frame_bytes), flags)
+        cache = FrameValidator._decode_cache
+        
+        with FrameValidator._decode_cache_lock:
+            frame = cache.get(key)
+            if frame is not None:
+                cache.move_to_end(key)
+                return frame
+        
+        frame = cv2.imdecode(np.frombuffer(frame_bytes, np.uint8), flags)
+        if frame is None:
+            return None
+        
+        max_bytes = FrameValidator.DECODE_CACHE_MAX_BYTES
+        if for_drawing or frame.nbytes > max_bytes:
+            return frame
+        
+        frame.setflags(write=False)
+        with FrameValidator._decode_cache_lock:
+            previous = cache.pop(key, None)
+            if previous is not None:
+                FrameValidator._decode_cache_bytes -= previous.nbytes
+            cache[key] = frame
+            FrameValidator._decode_cache_bytes += frame.nbytes
+            while len(cache) > cache_size or FrameValidator._decode_cache_bytes > max_bytes:
+                _, evicted = cache.popitem(last=False)
+                FrameValidator._decode_cache_bytes -= evicted.nbytes
+        
+        return frame
+    
     @staticmethod
     def validate_session_id(session_id: str) -> Tuple[bool, str]:
         """
@@ -184,7 +444,7 @@ class FrameValidator:
             return False, "Session ID muito curto"
         
         # Verificar caracteres válidos (alphanumeric, underscore, hyphen)
-        if not session_id.replace("_", "").replace("-", "").isalnum():
+        if not _SESSION_ID_RE.match(session_id):
             return False, "Session ID contém caracteres inválidos (use apenas alphanumeric, _ e -)"
         
         return True, "OK"
@@ -194,6 +454,10 @@ class FrameValidator:
 # OUTPUT FILTERING GUARDRAILS
 # =============================================================================
 
+# Campos obrigatórios de uma detecção válida (tupla: a ordem aparece nos warnings)
+_REQUIRED_FIELDS = ("class_id", "class_name", "track_id")
+
+
 class DetectionValidator:
     """
     Validador de detecções de saída
@@ -232,6 +496,7 @@ class DetectionValidator:
         
         h, w = frame_shape
         valid_detections = []
+        valid_confidences = []
         warnings = []
         
         # Estatísticas para logging
@@ -240,102 +505,138 @@ class DetectionValidator:
         rejected_too_small = 0
         rejected_out_of_bounds = 0
         
+        # Limites em variáveis locais (evita a busca do atributo da classe a cada uso)
+        min_confidence = DetectionValidator.MIN_CONFIDENCE
+        min_bbox_area = DetectionValidator.MIN_BBOX_AREA
+        max_bbox_size_ratio = DetectionValidator.MAX_BBOX_SIZE_RATIO
+        max_detections = DetectionValidator.MAX_DETECTIONS_PER_FRAME
+        tolerance = 0.05
+        min_x, min_y = -w * tolerance, -h * tolerance
+        max_x, max_y = w * (1 + tolerance), h * (1 + tolerance)
+        far_x, far_y, far_w, far_h = -w * 0.1, -h * 0.1, w * 1.1, h * 1.1
+        frame_area = w * h
+        add_warning = warnings.append
+        
         for i, det in enumerate(detections):
             if not isinstance(det, dict):
-                warnings.append(f"Detecção {i} não é um dicionário, ignorada")
+                add_warning(f"Detecção {i} não é um dicionário, ignorada")
                 continue
             
-            # 1. Verificar confiança mínima
-            confidence = det.get("confidence", 0.0)
+            # 1. Verificar confiança mínima (indexação direta: o campo quase sempre existe)
+            try:
+                confidence = det["confidence"]
+            except KeyError:
+                confidence = 0.0
             if not isinstance(confidence, (int, float)):
-                warnings.append(f"Detecção {i} tem confiança inválida: {confidence}")
+                add_warning(f"Detecção {i} tem confiança inválida: {confidence}")
                 continue
             
-            if confidence < DetectionValidator.MIN_CONFIDENCE:
+            if confidence < min_confidence:
                 rejected_low_confidence += 1
                 continue
             
             # 2. Validar bounding box
-            bbox = det.get("bbox", [])
-            if not isinstance(bbox, list):
-                warnings.append(f"Detecção {i} tem bbox inválido (não é lista)")
+            try:
+                bbox = det["bbox"]
+            except KeyError:
+                bbox = []
+            if not isinstance(bbox, (list, tuple)):
+                add_warning(f"Detecção {i} tem bbox inválido (não é lista)")
                 continue
             
             if len(bbox) != 4:
-                warnings.append(f"Detecção {i} tem bbox com tamanho incorreto: {len(bbox)} (esperado 4)")
+                add_warning(
+                    f"Detecção {i} tem bbox com tamanho incorreto: {len(bbox)} (esperado 4)"
+                )
                 rejected_invalid_bbox += 1
                 continue
             
             try:
                 x1, y1, x2, y2 = [float(coord) for coord in bbox]
             except (ValueError, TypeError):
-                warnings.append(f"Detecção {i} tem coordenadas bbox inválidas: {bbox}")
+                add_warning(f"Detecção {i} tem coordenadas bbox inválidas: {bbox}")
                 rejected_invalid_bbox += 1
                 continue
             
             # 3. Verificar se bbox é válido (x1 < x2, y1 < y2)
             if x1 >= x2 or y1 >= y2:
-                warnings.append(f"Detecção {i} tem bbox inválido: coordenadas invertidas ({x1}, {y1}, {x2}, {y2})")
+                add_warning(
+                    f"Detecção {i} tem bbox inválido: coordenadas invertidas "
+                    f"({x1}, {y1}, {x2}, {y2})"
+                )
                 rejected_invalid_bbox += 1
                 continue
             
             # 4. Verificar se bbox está dentro do frame (com tolerância de 5%)
-            tolerance = 0.05
-            if x1 < -w * tolerance or y1 < -h * tolerance or x2 > w * (1 + tolerance) or y2 > h * (1 + tolerance):
+            if x1 < min_x or y1 < min_y or x2 > max_x or y2 > max_y:
                 # Permitir pequenas extensões, mas registrar warning
-                if x1 < -w * 0.1 or y1 < -h * 0.1 or x2 > w * 1.1 or y2 > h * 1.1:
+                if x1 < far_x or y1 < far_y or x2 > far_w or y2 > far_h:
                     rejected_out_of_bounds += 1
                     continue
-                else:
-                    # Clamp bbox ao frame
-                    x1 = max(0, min(x1, w))
-                    y1 = max(0, min(y1, h))
-                    x2 = max(0, min(x2, w))
-                    y2 = max(0, min(y2, h))
-                    warnings.append(f"Detecção {i}: bbox foi ajustado para dentro do frame")
+                # Clamp bbox ao frame
+                x1 = max(0, min(x1, w))
+                y1 = max(0, min(y1, h))
+                x2 = max(0, min(x2, w))
+                y2 = max(0, min(y2, h))
+                add_warning(f"Detecção {i}: bbox foi ajustado para dentro do frame")
             
             # 5. Verificar área mínima
             area = (x2 - x1) * (y2 - y1)
-            if area < DetectionValidator.MIN_BBOX_AREA:
+            if area < min_bbox_area:
                 rejected_too_small += 1
                 continue
             
             # 6. Verificar se bbox não ocupa mais que X% do frame (possível erro)
-            frame_area = w * h
             bbox_ratio = area / frame_area if frame_area > 0 else 0
-            if bbox_ratio > DetectionValidator.MAX_BBOX_SIZE_RATIO:
-                warnings.append(f"Detecção {i}: bbox muito grande ({bbox_ratio*100:.1f}% do frame), possivelmente um erro")
+            if bbox_ratio > max_bbox_size_ratio:
+                add_warning(
+                    f"Detecção {i}: bbox muito grande ({bbox_ratio*100:.1f}% do frame), "
+                    f"possivelmente um erro"
+                )
                 # Não rejeitar, apenas avisar
             
             # 7. Verificar campos obrigatórios
-            required_fields = ["class_id", "class_name", "track_id"]
-            missing_fields = [field for field in required_fields if field not in det]
+            missing_fields = [field for field in _REQUIRED_FIELDS if field not in det]
             if missing_fields:
-                warnings.append(f"Detecção {i} está faltando campos: {missing_fields}")
+                add_warning(f"Detecção {i} está faltando campos: {missing_fields}")
                 continue
             
             # Criar detecção validada com bbox ajustado
             validated_det = det.copy()
             validated_det["bbox"] = [float(x1), float(y1), float(x2), float(y2)]
-            validated_det["confidence"] = float(confidence)
+            validated_det["confidence"] = confidence = float(confidence)
             valid_detections.append(validated_det)
+            valid_confidences.append(confidence)
         
         # Limitar número máximo de detecções
-        if len(valid_detections) > DetectionValidator.MAX_DETECTIONS_PER_FRAME:
-            # Priorizar por confiança
-            valid_detections.sort(key=lambda x: x.get("confidence", 0), reverse=True)
-            removed = len(valid_detections) - DetectionValidator.MAX_DETECTIONS_PER_FRAME
-            valid_detections = valid_detections[:DetectionValidator.MAX_DETECTIONS_PER_FRAME]
-            warnings.append(f"Limite de {DetectionValidator.MAX_DETECTIONS_PER_FRAME} detecções por frame excedido. {removed} detecções removidas (menor confiança)")
-        
-        # Log de estatísticas
-        if rejected_low_confidence > 0 or rejected_invalid_bbox > 0 or rejected_too_small > 0 or rejected_out_of_bounds > 0:
+        if len(valid_detections) > max_detections:
+            # Priorizar por confiança: seleção parcial O(N) das K maiores em vez de sort completo,
+            # mantendo as selecionadas na ordem original das detecções
+            top = np.argpartition(-np.asarray(valid_confidences), max_detections - 1)
+            top = top[:max_detections]
+            removed = len(valid_detections) - max_detections
+            valid_detections = [valid_detections[k] for k in np.sort(top).tolist()]
+            warnings.append(
+                f"Limite de {max_detections} detecções por frame excedido. "
+                f"{removed} detecções removidas (menor confiança)"
+            )
+        
+        # Log de estatísticas (formatado só se DEBUG estiver ativo)
+        if logger.isEnabledFor(logging.DEBUG) and (
+            rejected_low_confidence > 0 or rejected_invalid_bbox > 0
+            or rejected_too_small > 0 or rejected_out_of_bounds > 0
+        ):
             logger.debug(
-                f"Validação de detecções: {len(valid_detections)} válidas, "
-                f"rejeitadas - confiança baixa: {rejected_low_confidence}, "
-                f"bbox inválido: {rejected_invalid_bbox}, "
-                f"muito pequenas: {rejected_too_small}, "
-                f"fora do frame: {rejected_out_of_bounds}"
+                "Validação de detecções: %d válidas, "
+                "rejeitadas - confiança baixa: %d, "
+                "bbox inválido: %d, "
+                "muito pequenas: %d, "
+                "fora do frame: %d",
+                len(valid_detections),
+                rejected_low_confidence,
+                rejected_invalid_bbox,
+                rejected_too_small,
+                rejected_out_of_bounds
             )
         
         return valid_detections, warnings
@@ -0,0 +1,39 @@
+"""Testes do formato binário das respostas em lote (frame_protocol)"""
+
+import struct
+
+import pytest
+
+from frame_protocol import pack_frames_response, unpack_frames_response
+
+
+def test_pack_unpack_round_trip():
+    frames = [b"\xff\xd8jpeg-a\xff\xd9", b"\xff\xd8jpeg-bb\xff\xd9"]
+    header = {"results": [
+        {"session_id": "a", "detections": [], "annotated_frame_size": len(frames[0])},
+        {"session_id": "b", "error": "Frame validation failed: ..."},
+        {"session_id": "c", "detections": [], "annotated_frame_size": len(frames[1])},
+    ]}
+
+    unpacked_header, unpacked_frames = unpack_frames_response(pack_frames_response(header, frames))
+
+    assert unpacked_header == header
+    assert list(unpacked_frames) == frames
+
+
+def test_pack_unpack_without_frames():
+    header = {"error": "Lote muito grande", "results": []}
+
+    unpacked_header, unpacked_frames = unpack_frames_response(pack_frames_response(header, []))
+
+    assert unpacked_header == header
+    assert list(unpacked_frames) == []
+
+
+def test_unpack_rejects_truncated_body():
+    body = pack_frames_response({"results": []}, [])
+
+    with pytest.raises(ValueError):
+        unpack_frames_response(body[:-1])
+    with pytest.raises(struct.error):
+        unpack_frames_response(body[:3])
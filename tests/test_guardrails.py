@@ -0,0 +1,161 @@
+"""Testes dos guardrails de entrada (dimensões do JPEG) e de saída (validação de detecções)"""
+
+import struct
+
+import cv2
+import numpy as np
+import pytest
+
+from guardrails import DetectionValidator, FrameValidator
+
+
+def encode_test_jpeg(width: int, height: int, progressive: bool = False) -> bytes:
+    """JPEG de teste (baseline/SOF0 ou progressivo/SOF2)"""
+    image = np.full((height, width, 3), 128, dtype=np.uint8)
+    ok, buffer = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_PROGRESSIVE, int(progressive)])
+    assert ok
+    return buffer.tobytes()
+
+
+def with_exif_orientation(jpeg: bytes, orientation: int) -> bytes:
+    """Insere um segmento APP1 (EXIF) com a tag de orientação logo após o SOI"""
+    tiff = b"MM\x00\x2a" + struct.pack(">I", 8)
+    tiff += struct.pack(">H", 1) + struct.pack(">HHIHH", 0x0112, 3, 1, orientation, 0)
+    tiff += struct.pack(">I", 0)
+    payload = b"Exif\x00\x00" + tiff
+    app1 = b"\xff\xe1" + struct.pack(">H", len(payload) + 2) + payload
+    return jpeg[:2] + app1 + jpeg[2:]
+
+
+def make_detection(bbox, confidence: float = 0.9, track_id: int = 1):
+    return {
+        "bbox": bbox,
+        "confidence": confidence,
+        "class_id": 0,
+        "class_name": "person",
+        "track_id": track_id
+    }
+
+
+# =============================================================================
+# jpeg_dimensions
+# =============================================================================
+
+@pytest.mark.parametrize("progressive", [False, True], ids=["SOF0", "SOF2"])
+def test_jpeg_dimensions_reads_sof(progressive):
+    jpeg = encode_test_jpeg(320, 200, progressive)
+    marker = b"\xff\xc2" if progressive else b"\xff\xc0"
+    assert marker in jpeg
+
+    assert FrameValidator.jpeg_dimensions(jpeg) == (320, 200)
+
+
+def test_jpeg_dimensions_skips_exif_segment():
+    # As dimensões são as gravadas no SOF; a orientação EXIF é aplicada só na decodificação
+    jpeg = with_exif_orientation(encode_test_jpeg(800, 400), 6)
+
+    assert FrameValidator.jpeg_dimensions(jpeg) == (800, 400)
+    assert cv2.imdecode(np.frombuffer(jpeg, np.uint8), cv2.IMREAD_COLOR).shape[:2] == (800, 400)
+
+
+def test_jpeg_dimensions_truncated_input():
+    jpeg = encode_test_jpeg(320, 200)
+    sof = jpeg.index(b"\xff\xc0")
+
+    assert FrameValidator.jpeg_dimensions(jpeg[:sof]) is None
+    assert FrameValidator.jpeg_dimensions(jpeg[:sof + 6]) is None
+    assert FrameValidator.jpeg_dimensions(jpeg[:3]) is None
+    assert FrameValidator.jpeg_dimensions(b"") is None
+
+
+def test_jpeg_dimensions_rejects_non_jpeg():
+    ok, png = cv2.imencode(".png", np.zeros((10, 10, 3), dtype=np.uint8))
+    assert ok
+
+    assert FrameValidator.jpeg_dimensions(png.tobytes()) is None
+
+
+def test_reduction_factor():
+    assert FrameValidator.reduction_factor(3840, 2160, 360) == 4
+    assert FrameValidator.reduction_factor(3840, 2160, 720) == 2
+    assert FrameValidator.reduction_factor(1280, 720, 720) == 1
+    assert FrameValidator.reduction_factor(1280, 720, None) == 1
+
+
+# =============================================================================
+# validate_detections
+# =============================================================================
+
+def test_validate_detections_matches_baseline_filtering():
+    frame_shape = (480, 640)
+    detections = [
+        make_detection([10, 10, 110, 110]),               # 0: válida
+        make_detection([10, 10, 110, 110], 0.1),          # 1: confiança baixa (sem warning)
+        make_detection([50, 50, 40, 60]),                 # 2: coordenadas invertidas
+        make_detection([100, 100, 680, 200]),             # 3: 5-10% fora do frame -> ajustada
+        make_detection([100, 100, 800, 200]),             # 4: mais de 10% fora -> rejeitada
+        make_detection([0, 0, 5, 5]),                     # 5: área pequena (sem warning)
+        {"bbox": [10, 10, 110, 110], "confidence": 0.9},  # 6: campos faltando
+        "não é detecção",                                 # 7: não é dicionário
+        make_detection([1, 2, 3]),                        # 8: bbox com tamanho errado
+        make_detection(["a", 0, 10, 10]),                 # 9: coordenada inválida
+    ]
+
+    valid, warnings = DetectionValidator.validate_detections(detections, frame_shape)
+
+    assert [det["bbox"] for det in valid] == [
+        [10.0, 10.0, 110.0, 110.0], [100.0, 100.0, 640.0, 200.0]
+    ]
+    assert all(isinstance(det["confidence"], float) for det in valid)
+    assert warnings == [
+        "Detecção 2 tem bbox inválido: coordenadas invertidas (50.0, 50.0, 40.0, 60.0)",
+        "Detecção 3: bbox foi ajustado para dentro do frame",
+        "Detecção 6 está faltando campos: ['class_id', 'class_name', 'track_id']",
+        "Detecção 7 não é um dicionário, ignorada",
+        "Detecção 8 tem bbox com tamanho incorreto: 3 (esperado 4)",
+        "Detecção 9 tem coordenadas bbox inválidas: ['a', 0, 10, 10]",
+    ]
+    # A detecção de entrada não é alterada (o bbox ajustado vai numa cópia)
+    assert detections[3]["bbox"] == [100, 100, 680, 200]
+
+
+def test_validate_detections_empty_and_invalid_inputs():
+    assert DetectionValidator.validate_detections([], (480, 640)) == ([], [])
+    assert DetectionValidator.validate_detections("x", (480, 640)) == (
+        [], ["Detecções devem ser uma lista"]
+    )
+    assert DetectionValidator.validate_detections([make_detection([0, 0, 50, 50])], (480,)) == (
+        [], ["Frame shape inválido"]
+    )
+
+
+def test_validate_detections_accepts_tuple_bbox():
+    # Mudança em relação ao baseline: bbox em tupla era rejeitado como "não é lista"
+    valid, warnings = DetectionValidator.validate_detections(
+        [make_detection((10, 10, 110, 110))], (480, 640)
+    )
+
+    assert warnings == []
+    assert valid[0]["bbox"] == [10.0, 10.0, 110.0, 110.0]
+
+
+def test_validate_detections_keeps_top_k_in_original_order():
+    max_detections = DetectionValidator.MAX_DETECTIONS_PER_FRAME
+    total = max_detections + 20
+    confidences = np.random.default_rng(0).permutation(np.linspace(0.31, 0.99, total)).tolist()
+    detections = [
+        make_detection([i, 0, i + 20, 20], confidence, track_id=i)
+        for i, confidence in enumerate(confidences)
+    ]
+
+    valid, warnings = DetectionValidator.validate_detections(detections, (480, 640))
+
+    # Mesmo conjunto que o baseline mantinha (as K maiores confianças)...
+    expected = sorted(range(total), key=lambda i: confidences[i], reverse=True)[:max_detections]
+    assert {det["track_id"] for det in valid} == set(expected)
+    # ...mas na ordem original das detecções, não ordenadas por confiança
+    assert [det["track_id"] for det in valid] == sorted(expected)
+    assert warnings == [
+        f"Limite de {max_detections} detecções por frame excedido. "
+        "20 detecções removidas (menor confiança)"
+    ]
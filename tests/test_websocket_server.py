@@ -0,0 +1,69 @@
+"""Testes do agrupamento de frames do servidor WebSocket (FrameBatcher)"""
+
+import asyncio
+import time
+
+from websocket_server import FrameBatcher
+
+
+class RecordingSender:
+    """send_batch falso: guarda os lotes recebidos e devolve um resultado por frame"""
+
+    def __init__(self):
+        self.batches = []
+
+    async def __call__(self, frames, session_ids):
+        self.batches.append(list(session_ids))
+        return [{"session_id": session_id} for session_id in session_ids]
+
+
+def test_frame_batcher_single_client_does_not_wait():
+    sender = RecordingSender()
+
+    async def run():
+        # max_wait alto: se o lote esperasse por outros frames, o teste perceberia
+        batcher = FrameBatcher(sender, lambda: 1, max_wait=1.0)
+        start = time.perf_counter()
+        result = await batcher.submit(b"frame", "a")
+        elapsed = time.perf_counter() - start
+        await batcher.close()
+        return result, elapsed
+
+    result, elapsed = asyncio.run(run())
+
+    assert result == {"session_id": "a"}
+    assert elapsed < 0.5
+    assert sender.batches == [["a"]]
+
+
+def test_frame_batcher_groups_concurrent_sessions():
+    sender = RecordingSender()
+
+    async def run():
+        batcher = FrameBatcher(sender, lambda: 3, max_wait=0.05)
+        results = await asyncio.gather(
+            *[batcher.submit(b"frame", session_id) for session_id in "abc"]
+        )
+        await batcher.close()
+        return results
+
+    results = asyncio.run(run())
+
+    assert results == [{"session_id": session_id} for session_id in "abc"]
+    assert sender.batches == [["a", "b", "c"]]
+
+
+def test_frame_batcher_isolates_batch_errors():
+    async def failing_sender(frames, session_ids):
+        raise RuntimeError("BentoML fora do ar")
+
+    async def run():
+        batcher = FrameBatcher(failing_sender, lambda: 2, max_wait=0.05)
+        results = await asyncio.gather(batcher.submit(b"frame", "a"), batcher.submit(b"frame", "b"))
+        await batcher.close()
+        return results
+
+    first, second = asyncio.run(run())
+
+    assert first == second == {"error": "BentoML fora do ar"}
+    assert first is not second
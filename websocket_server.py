@@ -7,16 +7,22 @@ Implementa guardrails de Input Validation
 import asyncio
 import websockets
 import json
-import base64
+import struct
 import numpy as np
 import cv2
-from typing import Set, Dict, Any
+from typing import Set, Dict, Any, Optional, List, Callable, Union
 import logging
 import aiohttp
 from datetime import datetime
 
 # Importar guardrails de Input Validation
 from guardrails import FrameValidator, RateLimiter
+from frame_protocol import unpack_frames_response
+
+try:
+    import orjson
+except ImportError:  # orjson é opcional: sem ele usa o json da stdlib
+    orjson = None
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
@@ -25,6 +31,109 @@ logger = logging.getLogger(__name__)
 # Configurações
 BENTOML_SERVICE_URL = "http://localhost:3000"  # URL do serviço BentoML
 WEBSOCKET_PORT = 8765
+BATCH_MAX_SIZE = 8  # Máximo de frames por requisição ao BentoML
+BATCH_MAX_WAIT = 0.010  # Segundos aguardando outros frames antes de enviar o lote
+
+def json_dumps(obj: Any) -> str:
+    """
+    Serializa uma mensagem JSON (orjson quando disponível)
+    
+    Retorna str para que a mensagem continue sendo enviada como frame de texto
+    do WebSocket; frames binários ficam reservados para conteúdo não-JSON.
+    """
+    if orjson is not None:
+        return orjson.dumps(obj).decode("utf-8")
+    return json.dumps(obj)
+
+def json_loads(data: Any) -> Any:
+    """Desserializa uma mensagem JSON (orjson quando disponível)"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+class FrameBatcher:
+    """
+    Agrupa frames de sessões concorrentes em uma única requisição ao BentoML
+    
+    O primeiro frame de um lote espera até max_wait segundos por outros frames
+    (ou até max_size frames); o lote é enviado como uma chamada a
+    /process_video_frames e cada resultado é entregue ao future de quem o submeteu.
+    
+    Cada sessão tem no máximo um frame em processamento, então a espera só acontece
+    quando active_sessions() indica sessões sem frame pendente que ainda podem
+    entrar no lote (com um único cliente o frame segue direto).
+    """
+    
+    def __init__(self, send_batch, active_sessions: Optional[Callable[[], int]] = None,
+                 max_size: int = BATCH_MAX_SIZE, max_wait: float = BATCH_MAX_WAIT):
+        self.max_size = max_size
+        self.max_wait = max_wait
+        self._send_batch = send_batch
+        self._active_sessions = active_sessions
+        self._pending = 0  # Frames submetidos ainda sem resultado
+        self._queue: Optional[asyncio.Queue] = None
+        self._collector: Optional[asyncio.Task] = None
+        self._in_flight: Set[asyncio.Task] = set()
+    
+    async def submit(self, frame_data: Union[str, bytes], session_id: str) -> Dict[str, Any]:
+        """Adiciona o frame ao próximo lote e aguarda o seu resultado"""
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        if self._collector is None or self._collector.done():
+            self._collector = asyncio.create_task(self._collect())
+        
+        future = asyncio.get_running_loop().create_future()
+        self._pending += 1
+        try:
+            self._queue.put_nowait((frame_data, session_id, future))
+            return await future
+        finally:
+            self._pending -= 1
+    
+    def _may_grow(self) -> bool:
+        """Indica se outra sessão ainda pode submeter um frame para o lote atual"""
+        if self._active_sessions is None:
+            return True
+        return self._active_sessions() > self._pending
+    
+    async def _collect(self):
+        """Monta lotes a partir da fila e dispara o envio sem bloquear o próximo lote"""
+        queue = self._queue
+        while True:
+            batch = [await queue.get()]
+            if queue.qsize() < self.max_size - 1 and self._may_grow():
+                await asyncio.sleep(self.max_wait)
+            while len(batch) < self.max_size and not queue.empty():
+                batch.append(queue.get_nowait())
+            
+            task = asyncio.create_task(self._dispatch(batch))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+    
+    async def _dispatch(self, batch: List[tuple]):
+        """Envia o lote e distribui os resultados aos futures de origem"""
+        frames = [frame_data for frame_data, _, _ in batch]
+        session_ids = [session_id for _, session_id, _ in batch]
+        
+        try:
+            results = await self._send_batch(frames, session_ids)
+        except Exception as e:
+            logger.error(f"Erro inesperado ao processar lote: {type(e).__name__} - {e}")
+            results = [{"error": str(e)} for _ in batch]
+        
+        for (_, _, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+    
+    async def close(self):
+        """Cancela a coleta e os lotes em andamento"""
+        tasks = list(self._in_flight)
+        if self._collector is not None:
+            tasks.append(self._collector)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._collector = None
 
 class VideoStreamHandler:
     """Gerenciador de streams de vídeo"""
@@ -32,6 +141,30 @@ class VideoStreamHandler:
     def __init__(self):
         self.active_connections: Set[Any] = set()
         self.session_data: Dict[str, Any] = {}
+        self._http: Optional[aiohttp.ClientSession] = None
+        self._batcher = FrameBatcher(self._post_frames, lambda: len(self.active_connections))
+    
+    async def _get_http_session(self) -> aiohttp.ClientSession:
+        """
+        Retorna a sessão HTTP compartilhada com o BentoML, criando-a se necessário
+        
+        A sessão mantém um pool de conexões keep-alive, evitando abrir uma nova
+        conexão TCP a cada frame. A criação é síncrona, então não há corrida
+        entre corrotinas no event loop.
+        """
+        if self._http is None or self._http.closed:
+            self._http = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=100, keepalive_timeout=60),
+                json_serialize=json_dumps
+            )
+        return self._http
+    
+    async def close(self):
+        """Encerra o batcher e fecha a sessão HTTP compartilhada"""
+        await self._batcher.close()
+        if self._http is not None and not self._http.closed:
+            await self._http.close()
+        self._http = None
         
     async def register(self, websocket: Any, session_id: str):
         """Registra nova conexão"""
@@ -55,54 +188,109 @@ class VideoStreamHandler:
         
         logger.info(f"Conexão removida: {session_id}")
         
-    async def process_frame(self, frame_data: str, session_id: str) -> Dict[str, Any]:
+    async def process_frame(self, frame_data: Union[str, bytes], session_id: str) -> Dict[str, Any]:
         """
         Processa frame através do serviço BentoML
+        
+        O frame é agrupado com frames de outras sessões recebidos ao mesmo tempo
+        e enviado em uma única requisição (ver FrameBatcher).
         """
         try:
-            # Preparar dados para o BentoML - WRAPPED IN 'data' field
-            payload = {
-                "data": {
-                    "frame": frame_data,
-                    "session_id": session_id,
-                    "return_annotated": True
-                }
-            }
-            
-            # Fazer requisição ASSÍNCRONA ao BentoML
-            async with aiohttp.ClientSession() as session:
-                try:
-                    async with session.post(
-                        f"{BENTOML_SERVICE_URL}/process_video_frame",
-                        json=payload,
-                        headers={"Content-Type": "application/json"},
-                        timeout=aiohttp.ClientTimeout(total=30)  # AUMENTADO PARA 30 SEGUNDOS
-                    ) as response:
-                        
-                        if response.status == 200:
-                            result = await response.json()
-                            
-                            # Atualizar estatísticas
-                            if session_id in self.session_data:  # VERIFICAÇÃO ADICIONAL
-                                self.session_data[session_id]["frames_processed"] += 1
-                            
-                            return result
-                        else:
-                            error_text = await response.text()
-                            logger.error(f"Erro no BentoML ({response.status}): {error_text}")
-                            return {"error": f"Processing error: {response.status}"}
-                
-                except asyncio.TimeoutError:
-                    logger.error(f"Timeout ao processar frame da sessão {session_id}")
-                    return {"error": "Processing timeout"}
-                except aiohttp.ClientError as e:
-                    logger.error(f"Erro de conexão ao BentoML: {type(e).__name__} - {e}")
-                    return {"error": f"Connection error: {str(e)}"}
-                    
+            return await self._batcher.submit(frame_data, session_id)
         except Exception as e:
             logger.error(f"Erro inesperado ao processar frame: {type(e).__name__} - {e}")
             return {"error": str(e)}
     
+    async def _post_frames(self, frames: List[Union[str, bytes]],
+                           session_ids: List[str]) -> List[Dict[str, Any]]:
+        """
+        Envia um lote de frames ao BentoML em uma única requisição
+        
+        Os JPEGs seguem puros em multipart/form-data para /process_video_frames_bytes
+        (frames em base64 de clientes de texto são decodificados aqui) e os frames
+        anotados voltam em bytes, sem base64 em nenhum sentido.
+        
+        Returns:
+            List[Dict[str, Any]]: Um resultado por frame, na mesma ordem; o frame
+            anotado vem em bytes em "annotated_frame"
+        """
+        results: List[Optional[Dict[str, Any]]] = [None] * len(frames)
+        
+        # Frames em base64 (clientes de texto, até MAX_FRAME_SIZE) são decodificados em uma
+        # thread para não travar o event loop de todas as conexões
+        encoded = [i for i, frame_data in enumerate(frames) if isinstance(frame_data, str)]
+        if encoded:
+            loop = asyncio.get_running_loop()
+            decoded = await loop.run_in_executor(
+                None, lambda: [FrameValidator.decode_frame_data(frames[i]) for i in encoded]
+            )
+            frames = list(frames)
+            for i, (is_valid, error_msg, frame_bytes) in zip(encoded, decoded):
+                if is_valid:
+                    frames[i] = frame_bytes
+                else:
+                    results[i] = {"error": f"Frame validation failed: {error_msg}"}
+        
+        form = aiohttp.FormData()
+        sent = [i for i in range(len(frames)) if results[i] is None]  # Índices dos frames enviados
+        if not sent:
+            return results
+        for i in sent:
+            form.add_field("frames", frames[i], filename=f"{i}.jpg", content_type="image/jpeg")
+        form.add_field("session_ids", json_dumps([session_ids[i] for i in sent]))
+        form.add_field("return_annotated", "true")
+        
+        # Fazer requisição ASSÍNCRONA ao BentoML (conexão reaproveitada do pool)
+        session = await self._get_http_session()
+        try:
+            async with session.post(
+                f"{BENTOML_SERVICE_URL}/process_video_frames_bytes",
+                data=form,
+                timeout=aiohttp.ClientTimeout(total=30)  # AUMENTADO PARA 30 SEGUNDOS
+            ) as response:
+                
+                if response.status == 200:
+                    header, annotated_frames = unpack_frames_response(
+                        await response.read(), json_loads
+                    )
+                    batch_results = header.get("results", [])
+                    if len(batch_results) == len(sent):
+                        for i, result in zip(sent, batch_results):
+                            if "annotated_frame_size" in result:
+                                result["annotated_frame"] = next(annotated_frames)
+                            results[i] = result
+                            
+                            # Atualizar estatísticas (só frames processados com sucesso)
+                            session_data = self.session_data.get(session_ids[i])
+                            if session_data is not None and not result.get("error"):
+                                session_data["frames_processed"] += 1
+                        
+                        return results
+                    
+                    logger.error(
+                        "Resposta do BentoML com %d resultados para %d frames",
+                        len(batch_results), len(sent)
+                    )
+                    error = header.get("error", "Invalid batch response")
+                else:
+                    error_text = await response.text()
+                    logger.error(f"Erro no BentoML ({response.status}): {error_text}")
+                    error = f"Processing error: {response.status}"
+        
+        except asyncio.TimeoutError:
+            logger.error(f"Timeout ao processar lote de {len(frames)} frames")
+            error = "Processing timeout"
+        except aiohttp.ClientError as e:
+            logger.error(f"Erro de conexão ao BentoML: {type(e).__name__} - {e}")
+            error = f"Connection error: {str(e)}"
+        except (ValueError, struct.error) as e:
+            logger.error(f"Resposta inválida do BentoML: {type(e).__name__} - {e}")
+            error = "Invalid batch response"
+        
+        # Frames enviados recebem o erro do lote (um dicionário por frame); os que falharam
+        # na decodificação mantêm o próprio erro
+        return [result if result is not None else {"error": error} for result in results]
+    
     async def broadcast_stats(self):
         """Envia estatísticas para todos os clientes conectados"""
         while True:
@@ -114,42 +302,117 @@ class VideoStreamHandler:
                 "timestamp": datetime.now().isoformat()
             }
             
-            # Enviar para todos os clientes
+            # Enviar para todos os clientes: serializar uma única vez e iterar sobre um snapshot,
+            # já que conexões podem entrar/sair enquanto os envios aguardam
             if self.active_connections:
+                payload = json_dumps(stats)
                 await asyncio.gather(
-                    *[ws.send(json.dumps(stats)) for ws in self.active_connections],
+                    *[ws.send(payload) for ws in list(self.active_connections)],
                     return_exceptions=True
                 )
 
 # Instância global do handler
 stream_handler = VideoStreamHandler()
 
+def enqueue_latest_frame(frame_queue: asyncio.Queue, frame_data: Union[str, bytes]) -> bool:
+    """
+    Enfileira o frame descartando o pendente, se houver (o frame mais recente vence)
+    
+    Returns:
+        bool: True se um frame pendente foi descartado
+    """
+    try:
+        frame_queue.put_nowait(frame_data)
+        return False
+    except asyncio.QueueFull:
+        frame_queue.get_nowait()
+        frame_queue.put_nowait(frame_data)
+        return True
+
+async def consume_frames(websocket: Any, session_id: str, frame_queue: asyncio.Queue):
+    """
+    Processa os frames da fila da sessão, um de cada vez, e envia os resultados ao cliente
+    """
+    while True:
+        frame_data = await frame_queue.get()
+        
+        try:
+            # Processar através do BentoML (que fará validação completa)
+            result = await stream_handler.process_frame(frame_data, session_id)
+            
+            # Preparar resposta (o frame anotado segue em um frame binário separado)
+            response = {
+                "type": "detection_result",
+                "session_id": session_id,
+                "detections": result.get("detections", []),
+                "timestamp": result.get("timestamp", 0)
+            }
+            
+            # Adicionar informações de validação se disponíveis (para debug)
+            if "validation_stats" in result:
+                response["validation_stats"] = result["validation_stats"]
+            
+            # Adicionar erro se houver
+            if "error" in result:
+                response["error"] = result["error"]
+                response["type"] = "error"
+                logger.warning(f"Erro no processamento para sessão {session_id}: {result['error']}")
+            
+            # Enviar resultado de volta
+            await websocket.send(json_dumps(response))
+            
+            # Enviar frame anotado (JPEG puro vindo do BentoML) em frame binário,
+            # sem base64 nem escape JSON sobre o payload de vários KB/MB
+            annotated_frame = result.get("annotated_frame")
+            if annotated_frame and "error" not in result:
+                await websocket.send(annotated_frame)
+        
+        except websockets.exceptions.ConnectionClosed:
+            return
+        except Exception as e:
+            logger.error(f"Erro ao processar frame de {session_id}: {e}")
+
 async def handle_client(websocket: Any):
     """
     Handler principal para cada cliente WebSocket
+    
+    A recepção de mensagens e o processamento de frames rodam em tasks separadas,
+    ligadas por uma fila de um único frame: se o BentoML estiver mais lento que a
+    taxa de envio do cliente, frames pendentes são descartados em favor do mais
+    recente, limitando a latência e a memória por sessão.
     """
     session_id = None
+    consumer = None
     
     try:
         # Aguardar mensagem inicial com session_id
         init_message = await websocket.recv()
-        init_data = json.loads(init_message)
+        init_data = json_loads(init_message)
         session_id = init_data.get("session_id", "unknown")
         
         # Registrar cliente
         await stream_handler.register(websocket, session_id)
         
         # Enviar confirmação
-        await websocket.send(json.dumps({
+        await websocket.send(json_dumps({
             "type": "connected",
             "session_id": session_id,
             "message": "Conectado ao servidor de streaming"
         }))
         
-        # Loop principal para processar frames
+        # Fila de frames da sessão, consumida por uma única task
+        frame_queue = asyncio.Queue(maxsize=1)
+        consumer = asyncio.create_task(consume_frames(websocket, session_id, frame_queue))
+        
+        # Loop principal para receber mensagens
         async for message in websocket:
             try:
-                data = json.loads(message)
+                if isinstance(message, bytes):
+                    # Frame JPEG puro em frame binário: chega sem base64 nem JSON do cliente
+                    # e segue assim até o BentoML
+                    data = {"type": "frame", "data": message}
+                else:
+                    data = json_loads(message)
                 
                 if data.get("type") == "frame":
                     # Processar frame de vídeo
@@ -163,7 +426,7 @@ async def handle_client(websocket: Any):
                         is_valid_session, session_error = FrameValidator.validate_session_id(session_id)
                         if not is_valid_session:
                             logger.warning(f"Session ID inválido no WebSocket: {session_error}")
-                            await websocket.send(json.dumps({
+                            await websocket.send(json_dumps({
                                 "type": "error",
                                 "session_id": session_id,
                                 "error": f"Invalid session_id: {session_error}"
@@ -173,7 +436,7 @@ async def handle_client(websocket: Any):
                         # Validação básica do frame (tamanho máximo)
                         if len(frame_data) > FrameValidator.MAX_FRAME_SIZE:
                             logger.warning(f"Frame muito grande rejeitado: {len(frame_data)} bytes")
-                            await websocket.send(json.dumps({
+                            await websocket.send(json_dumps({
                                 "type": "error",
                                 "session_id": session_id,
                                 "error": f"Frame too large: {len(frame_data)} bytes (max: {FrameValidator.MAX_FRAME_SIZE})"
@@ -181,43 +444,22 @@ async def handle_client(websocket: Any):
                             continue
                         
                         # Validação básica do formato
-                        if not isinstance(frame_data, str) or len(frame_data) < 100:
-                            logger.warning(f"Frame data inválido: não é string ou muito pequeno")
-                            await websocket.send(json.dumps({
+                        if not isinstance(frame_data, (str, bytes)) or len(frame_data) < 100:
+                            logger.warning("Frame data inválido: não é string/bytes ou pequeno")
+                            await websocket.send(json_dumps({
                                 "type": "error",
                                 "session_id": session_id,
                                 "error": "Invalid frame data format"
                             }))
                             continue
                         
-                        # Processar através do BentoML (que fará validação completa)
-                        result = await stream_handler.process_frame(frame_data, session_id)
-                        
-                        # Preparar resposta
-                        response = {
-                            "type": "detection_result",
-                            "session_id": session_id,
-                            "detections": result.get("detections", []),
-                            "annotated_frame": result.get("annotated_frame", ""),
-                            "timestamp": result.get("timestamp", 0)
-                        }
-                        
-                        # Adicionar informações de validação se disponíveis (para debug)
-                        if "validation_stats" in result:
-                            response["validation_stats"] = result["validation_stats"]
-                        
-                        # Adicionar erro se houver
-                        if "error" in result:
-                            response["error"] = result["error"]
-                            response["type"] = "error"
-                            logger.warning(f"Erro no processamento para sessão {session_id}: {result['error']}")
-                        
-                        # Enviar resultado de volta
-                        await websocket.send(json.dumps(response))
+                        # Enfileirar para processamento (substitui o frame pendente, se houver)
+                        if enqueue_latest_frame(frame_queue, frame_data):
+                            logger.debug("Frame pendente descartado para sessão %s", session_id)
                 
                 elif data.get("type") == "ping":
                     # Responder ao ping
-                    await websocket.send(json.dumps({"type": "pong"}))
+                    await websocket.send(json_dumps({"type": "pong"}))
                     
             except json.JSONDecodeError:
                 logger.error(f"Erro ao decodificar JSON de {session_id}")
@@ -229,6 +471,10 @@ async def handle_client(websocket: Any):
     except Exception as e:
         logger.error(f"Erro na conexão {session_id}: {e}")
     finally:
+        # Encerrar o consumidor: com a conexão fechada não há para onde enviar resultados
+        if consumer is not None:
+            consumer.cancel()
+            await asyncio.gather(consumer, return_exceptions=True)
         if session_id:
             await stream_handler.unregister(websocket, session_id)
 
@@ -242,9 +488,12 @@ async def main():
     asyncio.create_task(stream_handler.broadcast_stats())
     
     # Iniciar servidor WebSocket
-    async with websockets.serve(handle_client, "0.0.0.0", WEBSOCKET_PORT):
-        logger.info(f"Servidor WebSocket rodando em ws://localhost:{WEBSOCKET_PORT}")
-        await asyncio.Future()  # Rodar para sempre
+    try:
+        async with websockets.serve(handle_client, "0.0.0.0", WEBSOCKET_PORT):
+            logger.info(f"Servidor WebSocket rodando em ws://localhost:{WEBSOCKET_PORT}")
+            await asyncio.Future()  # Rodar para sempre
+    finally:
+        await stream_handler.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
@@ -4,19 +4,36 @@ Suporta streaming de vídeo em tempo real via WebRTC/WebSocket
 Implementa guardrails de Input Validation e Output Filtering
 """
 
+import os
+import asyncio
 import bentoml
 import numpy as np
 import cv2
+import torch
+import torch.nn.functional as F
+import yaml
+from torchvision.io import decode_jpeg, ImageReadMode
 from ultralytics import YOLO
-import base64
-from typing import Dict, Any, List
+from ultralytics.engine.results import Boxes
+from ultralytics.trackers.byte_tracker import BYTETracker
+from ultralytics.utils import IterableSimpleNamespace
+from ultralytics.utils.checks import check_yaml
+from ultralytics.utils.nms import non_max_suppression
+import pybase64
+from pathlib import Path
+from typing import Callable, Dict, Any, List, Optional, Tuple, Union
+from typing_extensions import Annotated
+from bentoml.validators import ContentType
 import time
-from collections import defaultdict
+from collections import OrderedDict
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pydantic import BaseModel
 import logging
 
 # Importar guardrails (Input Validation e Output Filtering)
 from guardrails import FrameValidator, DetectionValidator
+from frame_protocol import pack_frames_response
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
@@ -24,6 +41,43 @@ logger = logging.getLogger(__name__)
 
 # Configurações do serviço
 MODEL_PATH = "best.pt"
+MAX_BATCH_SIZE = 16  # Máximo de frames por chamada ao modelo (e por chamada a process_video_frames)
+BATCH_MAX_WAIT_MS = 5  # Espera por outros frames antes de rodar um lote de um único frame
+TRACKER_CONFIG = "bytetrack.yaml"  # Configuração do ByteTrack (arquivo do Ultralytics ou caminho)
+TRACK_HISTORY_LENGTH = 30  # Pontos mantidos na trilha de cada track
+MAX_TRACKED_SESSIONS = 256  # Sessões com ByteTrack em memória (a menos usada é descartada)
+MAX_TRACK_HISTORIES = 4096  # Trilhas mantidas no total (a atualizada há mais tempo é descartada)
+# Diferença média (níveis de cinza, miniatura 32x32) abaixo da qual o último resultado
+# é reaproveitado (0 = desativado)
+FRAME_DIFF_THRESHOLD = 2.0
+FRAME_THUMBNAIL_SIZE = 32  # Lado da miniatura em cinza usada na comparação entre frames
+JPEG_QUALITY = 70  # Qualidade do JPEG do frame anotado
+ANNOTATED_MAX_HEIGHT = 720  # Frames anotados mais altos são reduzidos antes do JPEG
+ENCODE_WORKERS = 2  # Threads dedicadas à codificação JPEG dos frames anotados
+GPU_JPEG_DECODE = True  # Decodificar JPEGs com nvJPEG direto na GPU quando não há frame anotado
+MODEL_INPUT_SIZE = 640  # Lado da entrada quadrada fixa do modelo (letterbox antes da inferência)
+# Decodificar JPEGs grandes já reduzidos (1/2, 1/4, 1/8) se ainda cobrirem a entrada do modelo
+REDUCED_JPEG_DECODE = True
+USE_TENSORRT = True  # Exportar/usar engine TensorRT FP16 quando houver GPU CUDA
+USE_CUDA_GRAPH = True  # Replay em CUDA graph do forward de lote 1 (checkpoint PyTorch em GPU)
+
+# Cores das classes (ciclam pelo class_id)
+CLASS_COLORS = np.array([
+    (255, 0, 0),    # Vermelho
+    (0, 255, 0),    # Verde
+    (0, 0, 255),    # Azul
+    (255, 255, 0),  # Amarelo
+    (255, 0, 255),  # Magenta
+    (0, 255, 255),  # Ciano
+    (128, 0, 128),  # Roxo
+    (255, 165, 0),  # Laranja
+    (0, 128, 0),    # Verde escuro
+    (0, 0, 128),    # Azul escuro
+], dtype=np.uint8)
+
+# cuDNN escolhe o kernel mais rápido por shape e operações FP32 restantes podem usar TF32
+torch.backends.cudnn.benchmark = True
+torch.set_float32_matmul_precision("high")
 
 # Modelos Pydantic para validação de entrada/saída
 class VideoFrameRequest(BaseModel):
@@ -53,91 +107,507 @@ class ModelInfoResponse(BaseModel):
     input_size: str
     tracking_enabled: bool
 
+def decode_frame_gpu(frame_bytes: bytes) -> Any:
+    """
+    Decodifica o JPEG com nvJPEG direto na memória da GPU
+    
+    Returns:
+        torch.Tensor: View (H, W, 3) uint8 RGB na GPU. Formatos que não são JPEG
+        caem no cv2.imdecode e voltam como np.ndarray BGR
+    """
+    if frame_bytes[:2] != b"\xff\xd8":
+        return cv2.imdecode(np.frombuffer(frame_bytes, np.uint8), cv2.IMREAD_COLOR)
+    
+    data = torch.frombuffer(bytearray(frame_bytes), dtype=torch.uint8)
+    return decode_jpeg(data, mode=ImageReadMode.RGB, device="cuda").permute(1, 2, 0)
+
+def letterbox_params(h: int, w: int) -> Tuple[float, int, int, int, int]:
+    """
+    Parâmetros do letterbox de um frame (h, w) para o quadrado MODEL_INPUT_SIZE
+    
+    Returns:
+        Tuple: (escala, nova largura, nova altura, padding à esquerda, padding no topo)
+    """
+    size = MODEL_INPUT_SIZE
+    gain = min(size / h, size / w)
+    new_h, new_w = round(h * gain), round(w * gain)
+    return gain, new_w, new_h, (size - new_w) // 2, (size - new_h) // 2
+
+def frame_thumbnail(frame: Any) -> np.ndarray:
+    """
+    Miniatura FRAME_THUMBNAIL_SIZE² em cinza (float32) para comparar frames consecutivos
+    
+    Aceita o frame BGR na CPU ou o tensor (H, W, 3) RGB na GPU (reduzido lá mesmo,
+    só a miniatura é copiada para a CPU).
+    """
+    size = FRAME_THUMBNAIL_SIZE
+    if isinstance(frame, np.ndarray):
+        small = cv2.resize(frame, (size, size), interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY).astype(np.float32)
+    
+    small = F.adaptive_avg_pool2d(frame.permute(2, 0, 1).float().unsqueeze(0), size)[0]
+    gray = 0.299 * small[0] + 0.587 * small[1] + 0.114 * small[2]
+    return gray.cpu().numpy()
+
+def load_model(model_path: str) -> YOLO:
+    """
+    Carrega o modelo YOLO, usando uma engine TensorRT FP16 quando houver GPU CUDA
+    
+    A engine é exportada uma única vez ao lado do checkpoint (best.pt -> best.engine)
+    e reexportada se o checkpoint for mais novo. Sem CUDA, ou se a exportação
+    falhar, o checkpoint PyTorch é usado diretamente.
+    """
+    if not USE_TENSORRT or not torch.cuda.is_available() or not model_path.endswith(".pt"):
+        return YOLO(model_path)
+    
+    engine_path = os.path.splitext(model_path)[0] + ".engine"
+    try:
+        if (not os.path.exists(engine_path)
+                or os.path.getmtime(engine_path) < os.path.getmtime(model_path)):
+            logger.info(f"Exportando {model_path} para TensorRT FP16 ({engine_path})")
+            engine_path = YOLO(model_path).export(
+                format="engine", half=True, dynamic=True, batch=MAX_BATCH_SIZE, workspace=4
+            )
+        return YOLO(engine_path, task="detect")
+    except Exception as e:
+        logger.warning(f"TensorRT indisponível ({type(e).__name__}: {e}), usando {model_path}")
+        return YOLO(model_path)
+
 class YOLOTracker:
     """Classe para gerenciar detecção e tracking de objetos"""
     
     def __init__(self, model_path: str):
-        self.model = YOLO(model_path)
-        self.trackers = {}
-        self.track_id_counter = 0
-        self.track_history = defaultdict(list)
+        self.model = load_model(model_path)
+        # Nome de cada classe do modelo, calculado uma vez e indexado pelo class_id
+        names = self.model.names
+        num_classes = max(names) + 1 if names else 0
+        self.class_names = tuple(names.get(i, f"class_{i}") for i in range(num_classes))
+        # Cores como tuplas de int prontas para o OpenCV, indexadas por class_id % len(color_lut)
+        # (um class_id fora do modelo, ex.: engine e metadados divergentes, também tem cor)
+        self.color_lut = tuple(map(tuple, CLASS_COLORS.tolist()))
+        # Checkpoint PyTorch em GPU: pesos channels-last e forward em autocast FP16
+        # (a engine TensorRT já é FP16 e não expõe um nn.Module)
+        self.use_amp = torch.cuda.is_available() and isinstance(self.model.model, torch.nn.Module)
+        if self.use_amp:
+            self.model.model.to(memory_format=torch.channels_last)
+        # Um ByteTrack por sessão: cada sessão é um stream de vídeo independente
+        with open(check_yaml(TRACKER_CONFIG), encoding="utf-8") as f:
+            self.tracker_config = IterableSimpleNamespace(**yaml.safe_load(f))
+        # Ambos em ordem de uso (LRU) para a memória não crescer com sessões e tracks encerradas
+        self.trackers: "OrderedDict[str, BYTETracker]" = OrderedDict()
+        # Trilha de cada (sessão, track): buffer circular (TRACK_HISTORY_LENGTH, 2) int32
+        # e total de pontos escritos
+        self.track_history: "OrderedDict[Tuple[str, int], Tuple[np.ndarray, int]]" = OrderedDict()
+        # Último frame inferido de cada sessão: (shape, miniatura, resultado) para pular
+        # frames repetidos
+        self.last_frames: "OrderedDict[str, Tuple[Tuple[int, int], np.ndarray, Dict[str, Any]]]" = (
+            OrderedDict()
+        )
+        # O modelo e o estado de tracking são compartilhados entre as threads do BentoML
+        self._lock = threading.Lock()
+        if self.use_amp and USE_CUDA_GRAPH:
+            self._capture_cuda_graph()
         
     def detect_and_track(self, frame: np.ndarray, session_id: str) -> Dict[str, Any]:
         """Realiza detecção e tracking de objetos em um frame"""
-        # Realizar detecção
-        results = self.model(frame, stream=False, verbose=False)
+        return self.detect_and_track_batch([frame], [session_id])[0]
+    
+    def detect_and_track_batch(self, frames: List[Any],
+                               session_ids: List[str]) -> List[Dict[str, Any]]:
+        """
+        Realiza detecção e tracking em vários frames com uma única chamada ao modelo
+        
+        Frames np.ndarray (BGR, CPU) e tensores (H, W, 3) RGB já na GPU (decode_frame_gpu)
+        podem vir misturados; cada grupo passa pelo modelo em uma chamada.
+        Frames praticamente iguais ao último frame inferido da sessão (FRAME_DIFF_THRESHOLD)
+        não passam pelo modelo e reaproveitam o resultado anterior.
+        """
+        thumbnails = None
+        if FRAME_DIFF_THRESHOLD > 0:
+            thumbnails = [frame_thumbnail(frame) for frame in frames]
+        
+        with self._lock, torch.inference_mode(), torch.autocast(
+            "cuda", dtype=torch.float16, enabled=self.use_amp, cache_enabled=False
+        ):
+            results: List[Optional[Dict[str, Any]]] = [None] * len(frames)
+            if thumbnails is not None:
+                for k, (frame, session_id) in enumerate(zip(frames, session_ids)):
+                    results[k] = self._reuse_result(frame, session_id, thumbnails[k])
+            
+            pending = [k for k in range(len(frames)) if results[k] is None]
+            boxes: List[Optional[Boxes]] = [None] * len(frames)
+            cpu_indices = [k for k in pending if isinstance(frames[k], np.ndarray)]
+            gpu_indices = [k for k in pending if not isinstance(frames[k], np.ndarray)]
+            
+            if cpu_indices:
+                cpu_boxes = self._detect_arrays([frames[k] for k in cpu_indices])
+                for k, frame_boxes in zip(cpu_indices, cpu_boxes):
+                    boxes[k] = frame_boxes
+            
+            if gpu_indices:
+                gpu_boxes = self._detect_tensors([frames[k] for k in gpu_indices])
+                for k, frame_boxes in zip(gpu_indices, gpu_boxes):
+                    boxes[k] = frame_boxes
+            
+            for k in pending:
+                session_id = session_ids[k]
+                results[k] = self._build_result(boxes[k], frames[k], session_id)
+                
+                if thumbnails is not None:
+                    # Cópia rasa: quem recebe o resultado substitui as chaves, não altera
+                    # as detecções
+                    self.last_frames[session_id] = (
+                        frames[k].shape[:2], thumbnails[k], dict(results[k])
+                    )
+                    self.last_frames.move_to_end(session_id)
+                    while len(self.last_frames) > MAX_TRACKED_SESSIONS:
+                        self.last_frames.popitem(last=False)
+            
+            return results
+    
+    def _reuse_result(self, frame: Any, session_id: str,
+                      thumbnail: np.ndarray) -> Optional[Dict[str, Any]]:
+        """
+        Resultado do último frame inferido da sessão, se o frame atual for visualmente igual
+        
+        A comparação é sempre contra o último frame que passou pelo modelo, então uma
+        mudança lenta acumula até ultrapassar o limiar e não fica presa ao resultado antigo.
+        """
+        last = self.last_frames.get(session_id)
+        if last is None:
+            return None
+        
+        shape, last_thumbnail, result = last
+        if tuple(frame.shape[:2]) != tuple(shape):
+            return None
+        if float(np.abs(thumbnail - last_thumbnail).mean()) >= FRAME_DIFF_THRESHOLD:
+            return None
+        
+        return {**result, "timestamp": time.time()}
+    
+    def _capture_cuda_graph(self) -> None:
+        """
+        Captura em um CUDA graph o forward de uma entrada (1, 3, MODEL_INPUT_SIZE, MODEL_INPUT_SIZE)
+        
+        Com a entrada fixa pelo letterbox, o forward de lote 1 (o caso comum do streaming)
+        é sempre a mesma sequência de kernels e o replay evita lançá-los um a um. Outros
+        shapes (lotes maiores) seguem pelo forward normal.
+        """
+        size = MODEL_INPUT_SIZE
+        try:
+            with torch.inference_mode(), torch.autocast(
+                "cuda", dtype=torch.float16, cache_enabled=False
+            ):
+                # A primeira chamada monta o predictor do Ultralytics (que funde conv + bn)
+                net = self._get_predictor().model.model
+                static_input = torch.zeros((1, 3, size, size), device="cuda")
+                
+                # Aquecimento em uma stream separada antes da captura
+                stream = torch.cuda.Stream()
+                stream.wait_stream(torch.cuda.current_stream())
+                with torch.cuda.stream(stream):
+                    for _ in range(3):
+                        net(static_input)
+                torch.cuda.current_stream().wait_stream(stream)
+                
+                graph = torch.cuda.CUDAGraph()
+                with torch.cuda.graph(graph):
+                    static_output = net(static_input)
+        except Exception as e:
+            logger.warning(
+                f"CUDA graph indisponível ({type(e).__name__}: {e}), usando o forward normal"
+            )
+            return
+        
+        eager_forward = net.forward
+        
+        # O head recalcula anchors/strides quando o shape (com o lote) muda e o graph lê os tensores
+        # que existiam na captura: referências fortes mantêm essa memória viva e são devolvidas
+        # ao head antes de cada replay
+        head = net.model[-1]
+        head_state = {
+            name: getattr(head, name)
+            for name in ("anchors", "strides", "shape") if hasattr(head, name)
+        }
+        
+        def graphed_forward(x: torch.Tensor, *args: Any, **kwargs: Any) -> Any:
+            # augment/embed/visualize mudam o grafo: só o forward simples usa o replay
+            if (x.shape == static_input.shape and x.dtype == static_input.dtype
+                    and not args and not any(kwargs.values())):
+                for name, value in head_state.items():
+                    setattr(head, name, value)
+                static_input.copy_(x)
+                graph.replay()
+                return static_output
+            return eager_forward(x, *args, **kwargs)
+        
+        # A saída é reescrita no próximo replay; o pós-processamento roda antes dele, sob self._lock
+        net.forward = graphed_forward
+        logger.info(f"Forward de lote 1 capturado em CUDA graph ({size}x{size})")
+    
+    def _detect_arrays(self, frames: List[np.ndarray]) -> List[Boxes]:
+        """
+        Detecção em frames BGR na CPU
         
+        Cada frame passa pelo letterbox para o quadrado fixo MODEL_INPUT_SIZE antes do
+        modelo, então o shape de entrada nunca muda (o cudnn.benchmark escolhe os kernels
+        uma vez e o letterbox do Ultralytics não redimensiona nada).
+        """
+        size = MODEL_INPUT_SIZE
+        batch = []
+        transforms = []
+        for frame in frames:
+            h, w = frame.shape[:2]
+            gain, new_w, new_h, left, top = letterbox_params(h, w)
+            
+            image = cv2.resize(frame, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+            image = cv2.copyMakeBorder(image, top, size - new_h - top, left, size - new_w - left,
+                                       cv2.BORDER_CONSTANT, value=(114, 114, 114))
+            
+            batch.append(image)
+            transforms.append((gain, left, top, w, h))
+        
+        results = self.model(batch, imgsz=MODEL_INPUT_SIZE, stream=False, verbose=False)
+        return self._restore_boxes([r.boxes.data for r in results], transforms)
+    
+    def _detect_tensors(self, frames: List[torch.Tensor]) -> List[Boxes]:
+        """
+        Detecção em frames que já estão na GPU, sem voltar para a CPU
+        
+        Mesmo letterbox de _detect_arrays, feito com operações de tensor na GPU. O forward
+        e o NMS são chamados direto: o pós-processamento do Ultralytics copiaria o lote
+        (B, 3, 640, 640) inteiro para a CPU para montar os Results, e aqui só os boxes
+        (N, 6) de cada frame voltam para o host.
+        """
+        size = MODEL_INPUT_SIZE
+        batch = []
+        transforms = []
+        for frame in frames:
+            h, w = frame.shape[:2]
+            gain, new_w, new_h, left, top = letterbox_params(h, w)
+            
+            image = frame.permute(2, 0, 1).unsqueeze(0).float().div_(255)
+            image = F.interpolate(image, size=(new_h, new_w), mode="bilinear", align_corners=False)
+            canvas = torch.full((3, size, size), 114 / 255, device=frame.device)
+            canvas[:, top:top + new_h, left:left + new_w] = image[0]
+            
+            batch.append(canvas)
+            transforms.append((gain, left, top, w, h))
+        
+        predictor = self._get_predictor()
+        backend = predictor.model
+        images = torch.stack(batch)
+        images = images.half() if backend.fp16 else images.float()
+        args = predictor.args
+        preds = non_max_suppression(
+            backend(images),
+            args.conf,
+            args.iou,
+            args.classes,
+            args.agnostic_nms,
+            max_det=args.max_det,
+            end2end=getattr(backend, "end2end", False),
+        )
+        return self._restore_boxes(preds, transforms)
+    
+    def _get_predictor(self) -> Any:
+        """Predictor do Ultralytics (AutoBackend e argumentos do NMS), montado na 1ª chamada"""
+        if self.model.predictor is None:
+            size = MODEL_INPUT_SIZE
+            self.model(np.zeros((size, size, 3), dtype=np.uint8), imgsz=size, verbose=False)
+        return self.model.predictor
+    
+    @staticmethod
+    def _restore_boxes(preds: List[torch.Tensor],
+                       transforms: List[Tuple[float, int, int, int, int]]) -> List[Boxes]:
+        """Leva os boxes (N, 6) da entrada com letterbox às coordenadas de cada frame original"""
+        frame_boxes = []
+        for pred, (gain, left, top, w, h) in zip(preds, transforms):
+            # Uma única cópia GPU -> CPU dos boxes por frame
+            data = pred[:, :6].float().cpu().numpy().copy()
+            data[:, [0, 2]] = ((data[:, [0, 2]] - left) / gain).clip(0, w)
+            data[:, [1, 3]] = ((data[:, [1, 3]] - top) / gain).clip(0, h)
+            frame_boxes.append(Boxes(data, (h, w)))
+        
+        return frame_boxes
+    
+    def _build_result(self, boxes: Optional[Boxes], frame: Any, session_id: str) -> Dict[str, Any]:
+        """Converte os boxes (NumPy) de um frame em detecções com tracking"""
         detections = []
         
-        for r in results:
-            if r.boxes is not None:
-                for box in r.boxes:
-                    # Extrair informações da detecção
-                    x1, y1, x2, y2 = box.xyxy[0].cpu().numpy()
-                    confidence = box.conf[0].cpu().numpy()
-                    class_id = int(box.cls[0].cpu().numpy())
-                    
+        if boxes is not None:
+            session_tracker = self._get_session_tracker(session_id)
+            
+            # O ByteTrack precisa ver todo frame, inclusive sem detecções: é assim que as tracks
+            # perdidas envelhecem (track_buffer) e o filtro de Kalman avança.
+            # Devolve (N, 8) com x1, y1, x2, y2, track_id, score, cls, idx das detecções rastreadas
+            tracks = session_tracker.update(boxes, frame if isinstance(frame, np.ndarray) else None)
+            
+            if len(tracks):
+                bboxes = tracks[:, :4]
+                centers = ((bboxes[:, :2] + bboxes[:, 2:]) / 2).tolist()
+                track_ids = tracks[:, 4].astype(np.int64).tolist()
+                confidences = tracks[:, 5].tolist()
+                class_ids = tracks[:, 6].astype(np.int32).tolist()
+                class_names = self.class_names
+                
+                for bbox, track_id, confidence, class_id, center in zip(
+                    bboxes.tolist(), track_ids, confidences, class_ids, centers
+                ):
                     # Obter nome da classe
-                    class_name = self.model.names[class_id] if class_id < len(self.model.names) else f"class_{class_id}"
+                    try:
+                        class_name = class_names[class_id]
+                    except IndexError:
+                        class_name = f"class_{class_id}"
                     
-                    detection = {
-                        "bbox": [float(x1), float(y1), float(x2), float(y2)],
-                        "confidence": float(confidence),
+                    detections.append({
+                        "bbox": bbox,
+                        "confidence": confidence,
                         "class_id": class_id,
                         "class_name": class_name,
-                        "track_id": self._assign_track_id(session_id, [x1, y1, x2, y2])
-                    }
-                    
-                    detections.append(detection)
-                    
-                    # Adicionar ao histórico de tracking
-                    center_x = (x1 + x2) / 2
-                    center_y = (y1 + y2) / 2
-                    self.track_history[detection["track_id"]].append((center_x, center_y))
+                        "track_id": track_id
+                    })
                     
-                    # Limitar histórico a últimos 30 pontos
-                    if len(self.track_history[detection["track_id"]]) > 30:
-                        self.track_history[detection["track_id"]].pop(0)
+                    # Adicionar ao histórico de tracking (o ponto mais antigo é sobrescrito)
+                    key = (session_id, track_id)
+                    buffer, count = self.track_history.get(key, (None, 0))
+                    if buffer is None:
+                        buffer = np.empty((TRACK_HISTORY_LENGTH, 2), dtype=np.int32)
+                    buffer[count % TRACK_HISTORY_LENGTH] = center
+                    self.track_history[key] = (buffer, count + 1)
+                    self.track_history.move_to_end(key)
+                
+                while len(self.track_history) > MAX_TRACK_HISTORIES:
+                    self.track_history.popitem(last=False)
         
         return {
             "detections": detections,
-            "frame_shape": list(frame.shape[:2]),
+            "frame_shape": [int(frame.shape[0]), int(frame.shape[1])],
             "timestamp": time.time(),
             "session_id": session_id
         }
     
-    def _assign_track_id(self, session_id: str, bbox: List[float]) -> int:
-        """Atribui um ID de tracking baseado em IoU com detecções anteriores"""
-        if session_id not in self.trackers:
-            self.trackers[session_id] = {}
+    def _get_session_tracker(self, session_id: str) -> BYTETracker:
+        """Retorna o ByteTrack da sessão, criando-o e descartando a sessão menos usada se preciso"""
+        session_tracker = self.trackers.get(session_id)
+        if session_tracker is not None:
+            self.trackers.move_to_end(session_id)
+            return session_tracker
         
-        center_x = (bbox[0] + bbox[2]) / 2
-        center_y = (bbox[1] + bbox[3]) / 2
+        session_tracker = self.trackers[session_id] = BYTETracker(self.tracker_config)
+        while len(self.trackers) > MAX_TRACKED_SESSIONS:
+            evicted_session, _ = self.trackers.popitem(last=False)
+            # Os IDs de track da sessão descartada recomeçariam do zero, então as trilhas vão junto
+            for key in [key for key in self.track_history if key[0] == evicted_session]:
+                del self.track_history[key]
+            logger.debug("Sessão %s descartada do tracking (LRU)", evicted_session)
         
-        min_distance = float('inf')
-        matched_id = None
+        return session_tracker
+    
+    def get_track_history(self, session_id: str, track_id: int) -> np.ndarray:
+        """
+        Retorna o histórico de posições de um objeto rastreado
         
-        for track_id, last_pos in self.trackers[session_id].items():
-            distance = np.sqrt((center_x - last_pos[0])**2 + (center_y - last_pos[1])**2)
-            if distance < min_distance and distance < 50:  # threshold de 50 pixels
-                min_distance = distance
-                matched_id = track_id
+        Args:
+            session_id: ID da sessão (IDs de track são numerados por sessão)
+            track_id: ID da track
         
-        if matched_id is None:
-            matched_id = self.track_id_counter
-            self.track_id_counter += 1
+        Returns:
+            np.ndarray: Array (N, 2) int32 com os últimos centros, do mais antigo ao mais recente
+        """
+        buffer, count = self.track_history.get((session_id, track_id), (None, 0))
+        if buffer is None:
+            return np.empty((0, 2), dtype=np.int32)
+        if count <= TRACK_HISTORY_LENGTH:
+            return buffer[:count]
+        return np.roll(buffer, -(count % TRACK_HISTORY_LENGTH), axis=0)
+
+class InferenceBatcher:
+    """
+    Agrupa frames de requisições concorrentes em uma única chamada ao modelo
+    
+    Os frames entram em uma fila; uma task de fundo monta lotes de até max_size
+    frames (esperando max_wait segundos quando há um único frame avulso na fila) e roda
+    detect_and_track_batch em uma thread, sem bloquear o event loop. Enquanto um
+    lote está no modelo, os frames seguintes se acumulam para o próximo.
+    Frames de submit_many já chegam agrupados (process_video_frames) e não esperam.
+    """
+    
+    def __init__(self, tracker: YOLOTracker, max_size: int = MAX_BATCH_SIZE,
+                 max_wait: float = BATCH_MAX_WAIT_MS / 1000):
+        self.tracker = tracker
+        self.max_size = max_size
+        self.max_wait = max_wait
+        self._queue: Optional[asyncio.Queue] = None
+        self._collector: Optional[asyncio.Task] = None
+    
+    def _enqueue(self, frame: np.ndarray, session_id: str, wait: bool = True) -> asyncio.Future:
+        """Coloca o frame na fila e retorna o future do seu resultado"""
+        # Criados sob demanda, já dentro do event loop do BentoML
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        if self._collector is None or self._collector.done():
+            self._collector = asyncio.create_task(self._collect())
         
-        self.trackers[session_id][matched_id] = (center_x, center_y)
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((frame, session_id, future, wait))
+        return future
+    
+    async def submit(self, frame: np.ndarray, session_id: str) -> Dict[str, Any]:
+        """Processa um frame no próximo lote e retorna o resultado de detect_and_track"""
+        return await self._enqueue(frame, session_id)
+    
+    async def submit_many(self, frames: List[np.ndarray], session_ids: List[str]) -> List[Any]:
+        """
+        Processa vários frames no próximo lote
         
-        return matched_id
+        Returns:
+            List: Resultado de cada frame, ou a exceção se o seu lote falhou
+        """
+        futures = [
+            self._enqueue(frame, session_id, wait=False)
+            for frame, session_id in zip(frames, session_ids)
+        ]
+        return await asyncio.gather(*futures, return_exceptions=True)
     
-    def get_track_history(self, track_id: int) -> List[tuple]:
-        """Retorna o histórico de posições de um objeto rastreado"""
-        return self.track_history.get(track_id, [])
+    async def _collect(self):
+        """Monta os lotes e os roda no modelo, um de cada vez"""
+        queue = self._queue
+        loop = asyncio.get_running_loop()
+        
+        while True:
+            first = await queue.get()
+            batch = [first]
+            if first[3] and queue.empty() and self.max_wait > 0:
+                await asyncio.sleep(self.max_wait)
+            while len(batch) < self.max_size and not queue.empty():
+                batch.append(queue.get_nowait())
+            
+            frames = [frame for frame, _, _, _ in batch]
+            session_ids = [session_id for _, session_id, _, _ in batch]
+            
+            try:
+                results = await loop.run_in_executor(
+                    None, self.tracker.detect_and_track_batch, frames, session_ids
+                )
+            except Exception as e:
+                logger.error(f"Erro na inferência do lote: {type(e).__name__} - {e}", exc_info=True)
+                for _, _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            
+            for (_, _, future, _), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
 
 # Inicializar o tracker globalmente
 tracker = YOLOTracker(MODEL_PATH)
 
+# Pool próprio para a codificação JPEG: roda em paralelo com a inferência do próximo lote
+# sem disputar as threads usadas na decodificação e no Output Filtering
+encode_pool = ThreadPoolExecutor(max_workers=ENCODE_WORKERS, thread_name_prefix="jpeg-encode")
+
 # Definir o serviço BentoML 1.4+
 @bentoml.service(
     name="yolo-realtime-tracker",
@@ -150,111 +620,431 @@ class YOLOService:
     
     def __init__(self):
         self.tracker = tracker
+        self.batcher = InferenceBatcher(tracker)
     
     @bentoml.api
-    def process_video_frame(self, data: Dict[str, Any]) -> Dict[str, Any]:
+    async def process_video_frame(self, data: Dict[str, Any]) -> Dict[str, Any]:
         """
         Endpoint para processar frames de vídeo codificados em base64
         Usado para integração com WebRTC/WebSocket
         Implementa guardrails de Input Validation e Output Filtering
+        
+        Decodificação e anotação rodam em threads; a inferência é agrupada com
+        frames de outras requisições simultâneas pelo InferenceBatcher.
         """
         try:
-            # ===================================================================
-            # INPUT VALIDATION - Guardrail de entrada
-            # ===================================================================
             frame_data = data.get("frame", "")
             session_id = data.get("session_id", "default")
+            loop = asyncio.get_running_loop()
             
-            # 1. Validar session_id
-            is_valid_session, session_error = FrameValidator.validate_session_id(session_id)
-            if not is_valid_session:
-                logger.warning(f"Session ID inválido: {session_error}")
-                return {
-                    "error": f"Invalid session_id: {session_error}",
-                    "detections": [],
-                    "frame_shape": [],
-                    "timestamp": time.time(),
-                    "session_id": session_id
-                }
-            
-            # 2. Validar frame_data (tamanho, formato, dimensões, rate limiting)
-            is_valid, error_msg, frame = FrameValidator.validate_frame_data(frame_data, session_id)
+            return_annotated = data.get("return_annotated", False)
             
-            if not is_valid:
-                logger.warning(f"Validação de frame falhou para sessão {session_id}: {error_msg}")
-                return {
-                    "error": f"Frame validation failed: {error_msg}",
-                    "detections": [],
-                    "frame_shape": [],
-                    "timestamp": time.time(),
-                    "session_id": session_id
-                }
-            
-            # Frame validado com sucesso!
-            logger.debug(f"Frame validado com sucesso para sessão {session_id}: {frame.shape[1]}x{frame.shape[0]}")
+            frame, source_shape, error_response = await loop.run_in_executor(
+                None, self._validate_input, frame_data, session_id, return_annotated
+            )
+            if error_response is not None:
+                return error_response
             
             # ===================================================================
             # PROCESSAMENTO - Detecção e tracking
             # ===================================================================
-            result = self.tracker.detect_and_track(frame, session_id)
+            result = await self.batcher.submit(frame, session_id)
             
-            # ===================================================================
-            # OUTPUT FILTERING - Guardrail de saída
-            # ===================================================================
-            # Validar formato do frame_shape retornado
-            frame_shape_tuple = tuple(result.get("frame_shape", []))
-            if len(frame_shape_tuple) != 2:
-                logger.error(f"Frame shape inválido retornado: {frame_shape_tuple}")
-                frame_shape_tuple = (frame.shape[0], frame.shape[1])
-            
-            # Validar e filtrar detecções
-            original_detections_count = len(result.get("detections", []))
-            valid_detections, warnings = DetectionValidator.validate_detections(
-                result.get("detections", []),
-                frame_shape_tuple
+            result, annotated_frame = await loop.run_in_executor(
+                None, self._finalize_result, result, frame, session_id, return_annotated,
+                source_shape
             )
+            if annotated_frame is not None:
+                result["annotated_frame"] = await loop.run_in_executor(
+                    encode_pool, encode_jpeg_base64, annotated_frame
+                )
             
-            # Log warnings se houver
-            if warnings:
-                for warning in warnings:
-                    logger.debug(f"Warning na validação de detecções: {warning}")
+            return result
             
-            # Atualizar resultado com detecções validadas
-            result["detections"] = valid_detections
-            result["frame_shape"] = list(frame_shape_tuple)
+        except Exception as e:
+            logger.error(f"Erro inesperado ao processar frame: {type(e).__name__} - {e}", exc_info=True)
+            return _error_response(f"Unexpected error: {str(e)}", data.get("session_id", "default"))
+    
+    @bentoml.api
+    async def process_video_frame_bytes(
+        self,
+        frame: Annotated[Path, ContentType("image/jpeg")],
+        /,
+        ctx: bentoml.Context
+    ) -> Dict[str, Any]:
+        """
+        Endpoint para processar um frame enviado como JPEG puro no corpo da requisição
+        Evita o base64 (33% maior e um decode a mais) de process_video_frame
+        Headers: X-Session-Id (padrão "default") e X-Return-Annotated ("true"/"false")
+        """
+        session_id = ctx.request.headers.get("x-session-id", "default")
+        return_annotated = ctx.request.headers.get("x-return-annotated", "false").lower() == "true"
+        
+        try:
+            loop = asyncio.get_running_loop()
+            frame_bytes = await loop.run_in_executor(None, frame.read_bytes)
             
-            # Adicionar estatísticas de validação ao resultado (opcional, para debug)
-            result["validation_stats"] = {
-                "original_count": original_detections_count,
-                "validated_count": len(valid_detections),
-                "warnings_count": len(warnings),
-                "warnings": warnings[:5]  # Limitar a 5 warnings no resultado
-            }
+            frame_array, source_shape, error_response = await loop.run_in_executor(
+                None, self._validate_input, frame_bytes, session_id, return_annotated
+            )
+            if error_response is not None:
+                return error_response
             
-            # ===================================================================
-            # ANOTAÇÃO - Gerar frame anotado se solicitado
-            # ===================================================================
-            if data.get("return_annotated", False):
-                annotated_frame = draw_annotations(frame, valid_detections, self.tracker)
-                _, buffer = cv2.imencode('.jpg', annotated_frame, [cv2.IMWRITE_JPEG_QUALITY, 70])
-                result["annotated_frame"] = base64.b64encode(buffer).decode('utf-8')
+            result = await self.batcher.submit(frame_array, session_id)
             
-            logger.debug(
-                f"Processamento concluído para sessão {session_id}: "
-                f"{len(valid_detections)} detecções válidas de {original_detections_count} originais"
+            result, annotated_frame = await loop.run_in_executor(
+                None, self._finalize_result, result, frame_array, session_id, return_annotated,
+                source_shape
             )
+            if annotated_frame is not None:
+                result["annotated_frame"] = await loop.run_in_executor(
+                    encode_pool, encode_jpeg_base64, annotated_frame
+                )
             
             return result
             
         except Exception as e:
             logger.error(f"Erro inesperado ao processar frame: {type(e).__name__} - {e}", exc_info=True)
-            return {
-                "error": f"Unexpected error: {str(e)}",
-                "detections": [],
-                "frame_shape": [],
-                "timestamp": time.time(),
-                "session_id": data.get("session_id", "default")
-            }
+            return _error_response(f"Unexpected error: {str(e)}", session_id)
+    
+    @bentoml.api
+    async def process_video_frames(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Endpoint para processar em lote frames de várias sessões
+        Recebe {"frames": [...], "session_ids": [...], "return_annotated": bool} e
+        retorna {"results": [...]}, um resultado por frame no formato de process_video_frame
+        Os frames válidos entram juntos no mesmo lote do modelo
+        """
+        frames_data = data.get("frames", [])
+        session_ids = data.get("session_ids", [])
+        return_annotated = data.get("return_annotated", False)
+        
+        error = _batch_error(frames_data, session_ids)
+        if error is not None:
+            return {"error": error, "results": []}
+        
+        results = await self._process_batch(
+            frames_data, session_ids, return_annotated, encode_jpeg_base64
+        )
+        return {"results": results}
+    
+    @bentoml.api
+    async def process_video_frames_bytes(
+        self,
+        frames: List[Annotated[Path, ContentType("image/jpeg")]],
+        session_ids: List[str],
+        return_annotated: bool = False
+    ) -> Annotated[bytes, ContentType("application/octet-stream")]:
+        """
+        Versão binária de process_video_frames, sem base64 em nenhum sentido
+        Recebe multipart/form-data com os JPEGs puros (campo "frames", um arquivo por frame),
+        "session_ids" (lista JSON) e "return_annotated"
+        
+        Resposta: uint32 big-endian com o tamanho do cabeçalho, o cabeçalho JSON
+        {"results": [...]} e, em seguida, os JPEGs anotados concatenados na ordem dos
+        resultados; cada resultado com frame anotado traz o seu tamanho em "annotated_frame_size".
+        """
+        loop = asyncio.get_running_loop()
+        
+        error = _batch_error(frames, session_ids)
+        if error is not None:
+            return pack_frames_response({"error": error, "results": []}, [])
+        
+        frames_data = await loop.run_in_executor(
+            None, lambda: [frame.read_bytes() for frame in frames]
+        )
+        results = await self._process_batch(frames_data, session_ids, return_annotated, encode_jpeg)
+        
+        annotated_frames = []
+        for result in results:
+            annotated_frame = result.pop("annotated_frame", None)
+            if annotated_frame is not None:
+                result["annotated_frame_size"] = len(annotated_frame)
+                annotated_frames.append(annotated_frame)
+        
+        return pack_frames_response({"results": results}, annotated_frames)
+    
+    async def _process_batch(self, frames_data: List[Union[str, bytes]], session_ids: List[str],
+                             return_annotated: bool,
+                             encode: Callable[[np.ndarray], Any]) -> List[Dict[str, Any]]:
+        """
+        Valida, infere, filtra e anota um lote de frames
+        
+        Args:
+            encode: Codificação do frame anotado (encode_jpeg_base64 ou encode_jpeg),
+                guardada em "annotated_frame" de cada resultado
+        
+        Returns:
+            List: Um resultado por frame, no formato de process_video_frame
+        """
+        loop = asyncio.get_running_loop()
+        
+        # INPUT VALIDATION - frames inválidos recebem o erro e ficam fora do lote
+        results, indices, frames, source_shapes = await loop.run_in_executor(
+            None, self._validate_batch, frames_data, session_ids, return_annotated
+        )
+        if not frames:
+            return results
+        
+        # PROCESSAMENTO - Detecção e tracking de todo o lote
+        batch_results = await self.batcher.submit_many(frames, [session_ids[i] for i in indices])
+        
+        # OUTPUT FILTERING e anotação de cada frame
+        annotated_frames = await loop.run_in_executor(
+            None, self._finalize_batch, results, indices, frames, source_shapes, session_ids,
+            batch_results, return_annotated
+        )
+        
+        # Codificação JPEG dos frames anotados em paralelo no pool dedicado
+        pending = [
+            (i, annotated) for i, annotated in zip(indices, annotated_frames)
+            if annotated is not None
+        ]
+        encoded = await asyncio.gather(
+            *[loop.run_in_executor(encode_pool, encode, annotated) for _, annotated in pending],
+            return_exceptions=True
+        )
+        for (i, _), annotated_frame in zip(pending, encoded):
+            if isinstance(annotated_frame, BaseException):
+                logger.error(
+                    f"Erro ao codificar frame anotado: "
+                    f"{type(annotated_frame).__name__} - {annotated_frame}"
+                )
+                results[i] = _error_response(
+                    f"Unexpected error: {str(annotated_frame)}", session_ids[i]
+                )
+            else:
+                results[i]["annotated_frame"] = annotated_frame
+        
+        return results
+    
+    def _validate_batch(
+        self, frames_data: List[Union[str, bytes]], session_ids: List[str],
+        return_annotated: bool = False
+    ) -> Tuple[
+        List[Optional[Dict[str, Any]]], List[int], List[Any], List[Optional[Tuple[int, int]]]
+    ]:
+        """
+        Valida os frames de um lote
+        
+        Returns:
+            Tuple: (resultados com as respostas de erro preenchidas, índices dos frames válidos,
+                    frames válidos decodificados, shape original de cada frame decodificado
+                    reduzido)
+        """
+        results: List[Optional[Dict[str, Any]]] = [None] * len(frames_data)
+        indices = []
+        frames = []
+        source_shapes = []
+        for i, (frame_data, session_id) in enumerate(zip(frames_data, session_ids)):
+            try:
+                frame, source_shape, error_response = self._validate_input(
+                    frame_data, session_id, return_annotated
+                )
+            except Exception as e:
+                logger.error(
+                    f"Erro inesperado ao validar frame: {type(e).__name__} - {e}", exc_info=True
+                )
+                frame, source_shape = None, None
+                error_response = _error_response(f"Unexpected error: {str(e)}", session_id)
+            
+            if error_response is not None:
+                results[i] = error_response
+            else:
+                indices.append(i)
+                frames.append(frame)
+                source_shapes.append(source_shape)
+        
+        return results, indices, frames, source_shapes
+    
+    def _finalize_batch(self, results: List[Optional[Dict[str, Any]]], indices: List[int],
+                        frames: List[np.ndarray], source_shapes: List[Optional[Tuple[int, int]]],
+                        session_ids: List[str], batch_results: List[Any],
+                        return_annotated: bool) -> List[Optional[np.ndarray]]:
+        """
+        Preenche em results o resultado final de cada frame válido do lote
+        
+        Returns:
+            List: Frame anotado (ainda não codificado) de cada frame válido, ou None
+        """
+        annotated_frames = []
+        for i, frame, source_shape, result in zip(indices, frames, source_shapes, batch_results):
+            annotated_frame = None
+            if isinstance(result, BaseException):
+                results[i] = _error_response(f"Unexpected error: {str(result)}", session_ids[i])
+            else:
+                try:
+                    results[i], annotated_frame = self._finalize_result(
+                        result, frame, session_ids[i], return_annotated, source_shape
+                    )
+                except Exception as e:
+                    logger.error(
+                        f"Erro inesperado ao processar frame: {type(e).__name__} - {e}",
+                        exc_info=True
+                    )
+                    results[i] = _error_response(f"Unexpected error: {str(e)}", session_ids[i])
+            annotated_frames.append(annotated_frame)
+        
+        return annotated_frames
+    
+    def _validate_input(self, frame_data: Union[str, bytes], session_id: str,
+                        return_annotated: bool = False
+                        ) -> Tuple[Optional[Any], Optional[Tuple[int, int]],
+                                   Optional[Dict[str, Any]]]:
+        """
+        INPUT VALIDATION - Guardrail de entrada
+        
+        Args:
+            frame_data: Frame em base64 (str) ou a imagem codificada em bytes
+            session_id: ID da sessão
+            return_annotated: O frame será desenhado e devolvido; sem anotação os JPEGs são
+                decodificados na GPU, com anotação a decodificação reduzida preserva a
+                resolução do frame anotado (até ANNOTATED_MAX_HEIGHT)
+        
+        Returns:
+            Tuple: (frame decodificado, shape (h, w) original se o JPEG foi decodificado
+                    reduzido ou None, None) se válido, ou (None, None, resposta de erro)
+        """
+        # 1. Validar session_id
+        is_valid_session, session_error = FrameValidator.validate_session_id(session_id)
+        if not is_valid_session:
+            logger.warning(f"Session ID inválido: {session_error}")
+            return None, None, _error_response(f"Invalid session_id: {session_error}", session_id)
+        
+        # 2. Validar frame_data (tamanho, formato, dimensões, rate limiting)
+        if isinstance(frame_data, bytes):
+            is_valid, error_msg, frame_bytes = True, "OK", frame_data
+        else:
+            is_valid, error_msg, frame_bytes = FrameValidator.decode_frame_data(frame_data)
+        
+        if is_valid:
+            decoder = None
+            target_min_dim = None
+            source_size = None
+            factor = 1
+            if not return_annotated and GPU_JPEG_DECODE and torch.cuda.is_available():
+                decoder = decode_frame_gpu
+            elif REDUCED_JPEG_DECODE:
+                # O letterbox leva o lado maior a MODEL_INPUT_SIZE: basta que o frame reduzido
+                # mantenha o lado maior >= MODEL_INPUT_SIZE (em termos do menor lado,
+                # proporcionalmente)
+                source_size = FrameValidator.jpeg_dimensions(frame_bytes)
+                if source_size is not None and min(source_size) > 0:
+                    w, h = source_size
+                    target_min_dim = -(-MODEL_INPUT_SIZE * min(w, h) // max(w, h))
+                    if return_annotated:
+                        # O frame anotado sai na resolução do decodificado: não reduzir abaixo
+                        # do que encode_jpeg manteria (menor lado até ANNOTATED_MAX_HEIGHT)
+                        target_min_dim = max(target_min_dim, min(w, h, ANNOTATED_MAX_HEIGHT))
+                    factor = FrameValidator.reduction_factor(w, h, target_min_dim)
+            
+            is_valid, error_msg, frame = FrameValidator.validate_frame_bytes(
+                frame_bytes, session_id, target_min_dim, decoder, for_drawing=return_annotated
+            )
+        
+        if not is_valid:
+            logger.warning(f"Validação de frame falhou para sessão {session_id}: {error_msg}")
+            return None, None, _error_response(f"Frame validation failed: {error_msg}", session_id)
+        
+        # Frame decodificado reduzido: guardar o shape original para devolver as detecções nele.
+        # Só o fator de redução muda a escala; o OpenCV aplica a orientação EXIF, então um frame
+        # girado (orientações 5-8) chega com largura e altura trocadas em relação ao SOF
+        source_shape = None
+        if factor > 1:
+            w, h = source_size
+            if (frame.shape[1] >= frame.shape[0]) != (w >= h):
+                w, h = h, w
+            source_shape = (h, w)
+        
+        # Frame validado com sucesso!
+        logger.debug(
+            "Frame validado com sucesso para sessão %s: %dx%d",
+            session_id, frame.shape[1], frame.shape[0]
+        )
+        return frame, source_shape, None
+    
+    def _finalize_result(self, result: Dict[str, Any], frame: np.ndarray, session_id: str,
+                         return_annotated: bool, source_shape: Optional[Tuple[int, int]] = None
+                         ) -> Tuple[Dict[str, Any], Optional[np.ndarray]]:
+        """
+        Aplica o Output Filtering ao resultado do tracker e desenha o frame anotado se solicitado
+        
+        Args:
+            source_shape: (h, w) original de um frame decodificado reduzido; as detecções são
+                levadas para essa resolução antes da validação (os limites valem em pixels
+                da imagem do cliente) e o frame_shape da resposta passa a ser esse
+        
+        Returns:
+            Tuple: (resultado, frame anotado a codificar com encode_jpeg_base64 ou None)
+        """
+        # ===================================================================
+        # OUTPUT FILTERING - Guardrail de saída
+        # ===================================================================
+        # Validar formato do frame_shape retornado
+        frame_shape_tuple = tuple(result.get("frame_shape", []))
+        if len(frame_shape_tuple) != 2:
+            logger.error(f"Frame shape inválido retornado: {frame_shape_tuple}")
+            frame_shape_tuple = (frame.shape[0], frame.shape[1])
+        
+        # Detecções nas coordenadas da imagem enviada pelo cliente (frame decodificado reduzido).
+        # Dicionários novos: a lista pode ser a mesma guardada para reaproveitar frames repetidos
+        detections = result.get("detections", [])
+        scale_x = scale_y = 1.0
+        if source_shape is not None:
+            scale_y = source_shape[0] / frame_shape_tuple[0]
+            scale_x = source_shape[1] / frame_shape_tuple[1]
+            frame_shape_tuple = tuple(source_shape)
+            if detections and isinstance(detections, list):
+                try:
+                    boxes = np.array([det["bbox"] for det in detections], dtype=np.float64)
+                    boxes = boxes.reshape(-1, 4)
+                except (KeyError, TypeError, ValueError):
+                    boxes = None  # Detecções malformadas seguem como estão e a validação as rejeita
+                if boxes is not None:
+                    boxes *= (scale_x, scale_y, scale_x, scale_y)
+                    detections = [
+                        {**det, "bbox": bbox} for det, bbox in zip(detections, boxes.tolist())
+                    ]
+        
+        # Validar e filtrar detecções
+        original_detections_count = len(detections)
+        valid_detections, warnings = DetectionValidator.validate_detections(
+            detections,
+            frame_shape_tuple
+        )
+        
+        # Log warnings se houver
+        if warnings:
+            for warning in warnings:
+                logger.debug("Warning na validação de detecções: %s", warning)
+        
+        # Atualizar resultado com detecções validadas
+        result["detections"] = valid_detections
+        result["frame_shape"] = list(frame_shape_tuple)
+        
+        # Adicionar estatísticas de validação ao resultado (opcional, para debug)
+        result["validation_stats"] = {
+            "original_count": original_detections_count,
+            "validated_count": len(valid_detections),
+            "warnings_count": len(warnings),
+            "warnings": warnings[:5]  # Limitar a 5 warnings no resultado
+        }
+        
+        # ===================================================================
+        # ANOTAÇÃO - Gerar frame anotado se solicitado
+        # ===================================================================
+        annotated_frame = None
+        if return_annotated:
+            # O desenho é no frame decodificado: bboxes voltam para a escala dele
+            annotated_frame = draw_annotations(frame, valid_detections, self.tracker, session_id,
+                                               scale=(1 / scale_x, 1 / scale_y))
+        
+        logger.debug(
+            "Processamento concluído para sessão %s: %d detecções válidas de %d originais",
+            session_id, len(valid_detections), original_detections_count
+        )
+        
+        return result, annotated_frame
     
     @bentoml.api
     def get_model_info(self) -> Dict[str, Any]:
@@ -263,20 +1053,80 @@ class YOLOService:
             "model_type": "YOLOv8",
             "classes": self.tracker.model.names,
             "num_classes": len(self.tracker.model.names),
-            "input_size": "Dynamic",
+            "input_size": f"{MODEL_INPUT_SIZE}x{MODEL_INPUT_SIZE}",
             "tracking_enabled": True
         }
 
-def draw_annotations(frame: np.ndarray, detections: List[Dict], tracker: YOLOTracker) -> np.ndarray:
-    """Desenha anotações no frame"""
-    annotated = frame.copy()
+_JPEG_ENCODE_PARAMS = [
+    cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY,
+    cv2.IMWRITE_JPEG_OPTIMIZE, 0,
+    cv2.IMWRITE_JPEG_PROGRESSIVE, 0,
+    cv2.IMWRITE_JPEG_SAMPLING_FACTOR, cv2.IMWRITE_JPEG_SAMPLING_FACTOR_420,
+]
+
+def encode_jpeg(image: np.ndarray) -> bytes:
+    """
+    Codifica o frame anotado em JPEG baseline 4:2:0 (sem a passada extra de otimização
+    de Huffman), reduzindo antes frames acima de ANNOTATED_MAX_HEIGHT
+    """
+    h, w = image.shape[:2]
+    if h > ANNOTATED_MAX_HEIGHT:
+        scale = ANNOTATED_MAX_HEIGHT / h
+        image = cv2.resize(image, (round(w * scale), ANNOTATED_MAX_HEIGHT),
+                           interpolation=cv2.INTER_AREA)
     
-    for det in detections:
-        bbox = det["bbox"]
-        x1, y1, x2, y2 = [int(x) for x in bbox]
-        
+    ok, buffer = cv2.imencode('.jpg', image, _JPEG_ENCODE_PARAMS)
+    if not ok:
+        raise ValueError("Falha ao codificar o frame anotado em JPEG")
+    return buffer.tobytes()
+
+def encode_jpeg_base64(image: np.ndarray) -> str:
+    """Codifica o frame anotado com encode_jpeg e base64 (respostas JSON)"""
+    return pybase64.b64encode_as_string(encode_jpeg(image))
+
+def _batch_error(frames: Any, session_ids: Any) -> Optional[str]:
+    """Verifica o formato de um lote; retorna a mensagem de erro ou None"""
+    if (not isinstance(frames, list) or not isinstance(session_ids, list)
+            or len(frames) != len(session_ids)):
+        return "frames e session_ids devem ser listas do mesmo tamanho"
+    if len(frames) > MAX_BATCH_SIZE:
+        return f"Lote muito grande: {len(frames)} frames (max: {MAX_BATCH_SIZE})"
+    return None
+
+def _error_response(error: str, session_id: str) -> Dict[str, Any]:
+    """Monta a resposta de erro no formato de VideoFrameResponse"""
+    return {
+        "error": error,
+        "detections": [],
+        "frame_shape": [],
+        "timestamp": time.time(),
+        "session_id": session_id
+    }
+
+def draw_annotations(frame: np.ndarray, detections: List[Dict], tracker: YOLOTracker,
+                     session_id: str, *, inplace: bool = True,
+                     scale: Tuple[float, float] = (1.0, 1.0)) -> np.ndarray:
+    """
+    Desenha anotações no frame
+    
+    Com inplace=True desenha direto no frame recebido, sem copiar a imagem inteira;
+    frames somente leitura (compartilhados pelo cache de decodificação) são copiados.
+    scale (x, y) leva os bboxes das detecções para as coordenadas do frame.
+    """
+    annotated = frame if inplace and frame.flags.writeable else frame.copy()
+    if not detections:
+        return annotated
+    
+    # Todos os bboxes convertidos para int32 de uma vez (trunca como int())
+    boxes = np.array([det["bbox"] for det in detections], dtype=np.float64)
+    if scale != (1.0, 1.0):
+        boxes *= (scale[0], scale[1], scale[0], scale[1])
+    boxes = boxes.astype(np.int32).tolist()
+    color_lut = tracker.color_lut
+    
+    for det, (x1, y1, x2, y2) in zip(detections, boxes):
         # Desenhar bounding box
-        color = get_color_for_class(det["class_id"])
+        color = color_lut[det["class_id"] % len(color_lut)]
         cv2.rectangle(annotated, (x1, y1), (x2, y2), color, 2)
         
         # Adicionar label
@@ -296,25 +1146,8 @@ def draw_annotations(frame: np.ndarray, detections: List[Dict], tracker: YOLOTra
                    0.5, (255, 255, 255), 1)
         
         # Desenhar trilha de tracking
-        track_history = tracker.get_track_history(det["track_id"])
+        track_history = tracker.get_track_history(session_id, det["track_id"])
         if len(track_history) > 1:
-            points = np.array(track_history, dtype=np.int32)
-            cv2.polylines(annotated, [points], False, color, 2)
+            cv2.polylines(annotated, [track_history], False, color, 2)
     
     return annotated
-
-def get_color_for_class(class_id: int) -> tuple:
-    """Retorna uma cor única para cada classe"""
-    colors = [
-        (255, 0, 0),    # Vermelho
-        (0, 255, 0),    # Verde
-        (0, 0, 255),    # Azul
-        (255, 255, 0),  # Amarelo
-        (255, 0, 255),  # Magenta
-        (0, 255, 255),  # Ciano
-        (128, 0, 128),  # Roxo
-        (255, 165, 0),  # Laranja
-        (0, 128, 0),    # Verde escuro
-        (0, 0, 128),    # Azul escuro
-    ]
-    return colors[class_id % len(colors)]
\ No newline at end of file